@@ -1,11 +1,20 @@
+import asyncio
 import os
 import requests
 from typing import List, Dict, Any, Optional
 from openai import OpenAI
 from dotenv import load_dotenv
+from .metrics import timed, timed_llm_call, record_provider_error, record_fallback
+from .llm_scheduler import LLMScheduler, ProviderBusy, INTERACTIVE, estimate_tokens
 
 load_dotenv()
 
+class ProviderError(Exception):
+    """Raised when the configured LLM provider could not produce a response."""
+
+# Rate limited providers, keyed by mode; LOCAL and ZOHO calls are not scheduled
+RATE_LIMITED_PROVIDERS = {"CLOUD": "openai", "GEMINI": "gemini", "GROQ": "groq", "OPENROUTER": "openrouter"}
+
 class ChatEngine:
     def __init__(self):
         self.mode = os.getenv("MODE", "LOCAL") # LOCAL, CLOUD, OPENROUTER, GEMINI, or GROQ
@@ -19,8 +28,30 @@ class ChatEngine:
         self.groq_model = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
         self.local_base_url = os.getenv("LOCAL_MODEL_BASE_URL", "http://localhost:11434/v1")
         self.local_model = "llama3" # Default local model
+        self.scheduler = LLMScheduler()
+
+    async def generate_response(
+        self,
+        query: str,
+        context: str,
+        raise_errors: bool = False,
+        priority: int = INTERACTIVE,
+        timeout: Optional[float] = None,
+    ) -> str:
+        # Wait for a rate limit slot (or fail fast after `timeout` seconds in the queue), then run the
+        # blocking provider call off the event loop
+        provider = RATE_LIMITED_PROVIDERS.get(self.mode)
+        try:
+            async with self.scheduler.slot(provider, estimate_tokens(query + context), priority, timeout):
+                # Queue time is recorded by the scheduler, so "llm" only covers the provider call
+                with timed("llm"):
+                    return await asyncio.to_thread(self._generate_response, query, context)
+        except (ProviderBusy, ProviderError) as e:
+            if raise_errors:
+                raise
+            return str(e)
 
-    async def generate_response(self, query: str, context: str) -> str:
+    def _generate_response(self, query: str, context: str) -> str:
         prompt = f"""
         You are an AI assistant for MCP-LiteLabs. Use the provided context to answer the user's question accurately.
         If the context doesn't contain the answer, say you don't know based on the documents.
@@ -35,11 +66,23 @@ class ChatEngine:
         """
         
         if self.mode == "CLOUD" and self.openai_client:
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4-turbo-preview",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7
-            )
+            try:
+                with timed_llm_call("openai", "gpt-4-turbo-preview"):
+                    # The raw response exposes the rate limit headers for the scheduler
+                    raw = self.openai_client.chat.completions.with_raw_response.create(
+                        model="gpt-4-turbo-preview",
+                        messages=[{"role": "user", "content": prompt}],
+                        temperature=0.7
+                    )
+                self.scheduler.observe("openai", raw.status_code, raw.headers)
+                response = raw.parse()
+            except Exception as e:
+                # API errors such as 429 carry the HTTP response, and with it Retry-After
+                error_response = getattr(e, "response", None)
+                if error_response is not None:
+                    self.scheduler.observe("openai", error_response.status_code, error_response.headers)
+                record_provider_error("openai", "gpt-4-turbo-preview")
+                raise
             return response.choices[0].message.content
         elif self.mode == "GEMINI" and self.gemini_key:
             try:
@@ -55,70 +98,91 @@ class ChatEngine:
                 ]
                 
                 last_error = ""
-                for model_name in models_to_try:
+                for i, model_name in enumerate(models_to_try):
+                    if i > 0:
+                        record_fallback("gemini", model_name)
                     try:
                         model = genai.GenerativeModel(model_name)
-                        response = model.generate_content(prompt)
+                        with timed_llm_call("gemini", model_name):
+                            response = model.generate_content(prompt)
                         return response.text
                     except Exception as e:
+                        # Gemini sends no rate limit headers, so a 429 (ResourceExhausted) is all we can learn from
+                        if getattr(e, "code", None) == 429:
+                            self.scheduler.observe("gemini", 429, {})
+                        record_provider_error("gemini", model_name)
                         last_error = str(e)
                         continue
                 
-                return f"Error from Gemini: {last_error}. None of the attempted models ({', '.join(models_to_try)}) were available for this key."
+                raise ProviderError(f"Error from Gemini: {last_error}. None of the attempted models ({', '.join(models_to_try)}) were available for this key.")
+            except ProviderError:
+                raise
             except Exception as e:
-                return f"Error configuring Gemini: {e}. Please ensure your API key is correct."
+                raise ProviderError(f"Error configuring Gemini: {e}. Please ensure your API key is correct.")
         elif self.mode == "GROQ" and self.groq_api_key:
             try:
-                response = requests.post(
-                    url="https://api.groq.com/openai/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {self.groq_api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": self.groq_model,
-                        "messages": [{"role": "user", "content": prompt}],
-                        "temperature": 0.7
-                    }
-                )
+                with timed_llm_call("groq", self.groq_model):
+                    response = requests.post(
+                        url="https://api.groq.com/openai/v1/chat/completions",
+                        headers={
+                            "Authorization": f"Bearer {self.groq_api_key}",
+                            "Content-Type": "application/json"
+                        },
+                        json={
+                            "model": self.groq_model,
+                            "messages": [{"role": "user", "content": prompt}],
+                            "temperature": 0.7
+                        }
+                    )
+                self.scheduler.observe("groq", response.status_code, response.headers)
                 if response.status_code == 200:
                     return response.json()["choices"][0]["message"]["content"]
                 else:
+                    record_provider_error("groq", self.groq_model)
                     error_msg = response.json().get("error", {}).get("message", response.text)
-                    return f"Groq Error: {error_msg}. (Status: {response.status_code})"
+                    raise ProviderError(f"Groq Error: {error_msg}. (Status: {response.status_code})")
+            except ProviderError:
+                raise
             except Exception as e:
-                return f"Error connecting to Groq: {e}"
+                record_provider_error("groq", self.groq_model)
+                raise ProviderError(f"Error connecting to Groq: {e}")
         elif self.mode == "ZOHO" and self.zoho_refresh_token:
             return "Zoho Zia mode is setting up! Once we have the token, I will be able to process your voice and document queries through Zia."
         elif self.mode == "OPENROUTER" and self.openrouter_api_key:
             # ... (OpenRouter logic remains the same)
+            # Auto-correct common outdated free model IDs
+            model_mapping = {
+                "qwen/qwen-2.5-72b-instruct:free": "qwen/qwen-2-72b-instruct:free",
+                "meta-llama/llama-3.1-405b-instruct:free": "meta-llama/llama-3.1-70b-instruct:free",
+                "google/gemini-pro:free": "google/gemini-2.0-flash-exp:free"
+            }
+            current_model = model_mapping.get(self.openrouter_model, self.openrouter_model)
             try:
-                # Auto-correct common outdated free model IDs
-                model_mapping = {
-                    "qwen/qwen-2.5-72b-instruct:free": "qwen/qwen-2-72b-instruct:free",
-                    "meta-llama/llama-3.1-405b-instruct:free": "meta-llama/llama-3.1-70b-instruct:free",
-                    "google/gemini-pro:free": "google/gemini-2.0-flash-exp:free"
-                }
-                current_model = model_mapping.get(self.openrouter_model, self.openrouter_model)
 
-                response = requests.post(
-                    url="https://openrouter.ai/api/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {self.openrouter_api_key}",
-                        "HTTP-Referer": "https://mcp-litelabs.local",
-                        "X-Title": "MCP-LiteLabs",
-                    },
-                    json={
-                        "model": current_model,
-                        "messages": [{"role": "user", "content": prompt}],
-                        "temperature": 0.7
-                    }
-                )
+                with timed_llm_call("openrouter", current_model):
+                    response = requests.post(
+                        url="https://openrouter.ai/api/v1/chat/completions",
+                        headers={
+                            "Authorization": f"Bearer {self.openrouter_api_key}",
+                            "HTTP-Referer": "https://mcp-litelabs.local",
+                            "X-Title": "MCP-LiteLabs",
+                        },
+                        json={
+                            "model": current_model,
+                            "messages": [{"role": "user", "content": prompt}],
+                            "temperature": 0.7
+                        }
+                    )
+                self.scheduler.observe("openrouter", response.status_code, response.headers)
                 if response.status_code == 200:
                     return response.json()["choices"][0]["message"]["content"]
+                record_provider_error("openrouter", current_model)
+                
+                # An account-wide limit applies to every free model, so fallbacks would only add more 429s
+                account_exhausted = response.status_code == 429 and response.headers.get("X-RateLimit-Remaining") == "0"
                 
                 # If we get a failure (404, 429, 503, etc.), try automated fallbacks
-                if response.status_code in [404, 429, 503, 504]:
+                if response.status_code in [404, 429, 503, 504] and not account_exhausted:
                     # Most reliable free models current on OpenRouter
                     fallbacks = [
                         "google/gemini-2.0-flash-exp:free",
@@ -131,59 +195,110 @@ class ChatEngine:
                     for fallback_model in fallbacks:
                         if current_model == fallback_model:
                             continue
+                        # Each fallback is another request against the same limits, so it needs its own slot
+                        wait = self.scheduler.try_acquire("openrouter", estimate_tokens(prompt))
+                        if wait > 0:
+                            raise ProviderBusy("openrouter", wait)
                             
+                        record_fallback("openrouter", fallback_model)
                         try:
-                            fallback_resp = requests.post(
-                                url="https://openrouter.ai/api/v1/chat/completions",
-                                headers={
-                                    "Authorization": f"Bearer {self.openrouter_api_key}",
-                                    "HTTP-Referer": "https://mcp-litelabs.local",
-                                    "X-Title": "MCP-LiteLabs",
-                                },
-                                json={
-                                    "model": fallback_model,
-                                    "messages": [{"role": "user", "content": prompt}],
-                                    "temperature": 0.7
-                                },
-                                timeout=10 # Short timeout for fallbacks
-                            )
+                            with timed_llm_call("openrouter", fallback_model):
+                                fallback_resp = requests.post(
+                                    url="https://openrouter.ai/api/v1/chat/completions",
+                                    headers={
+                                        "Authorization": f"Bearer {self.openrouter_api_key}",
+                                        "HTTP-Referer": "https://mcp-litelabs.local",
+                                        "X-Title": "MCP-LiteLabs",
+                                    },
+                                    json={
+                                        "model": fallback_model,
+                                        "messages": [{"role": "user", "content": prompt}],
+                                        "temperature": 0.7
+                                    },
+                                    timeout=10 # Short timeout for fallbacks
+                                )
+                            self.scheduler.observe("openrouter", fallback_resp.status_code, fallback_resp.headers)
                             if fallback_resp.status_code == 200:
                                 return fallback_resp.json()["choices"][0]["message"]["content"]
+                            record_provider_error("openrouter", fallback_model)
                         except:
+                            record_provider_error("openrouter", fallback_model)
                             continue
                     
-                    return f"OpenRouter Error ({response.status_code}): None of the free models responded. Tip: Go to openrouter.ai/settings and verify your email. Most free models (like Gemini) require a verified account."
+                    raise ProviderError(f"OpenRouter Error ({response.status_code}): None of the free models responded. Tip: Go to openrouter.ai/settings and verify your email. Most free models (like Gemini) require a verified account.")
                 else:
                     error_data = response.json() if response.headers.get('content-type') == 'application/json' else response.text
-                    return f"OpenRouter Error: {error_data}. Tip: Check if your API key has enough credits or if the service is down."
+                    raise ProviderError(f"OpenRouter Error: {error_data}. Tip: Check if your API key has enough credits or if the service is down.")
+            except (ProviderBusy, ProviderError):
+                raise
             except Exception as e:
-                return f"Error connecting to OpenRouter: {e}"
+                record_provider_error("openrouter", current_model)
+                raise ProviderError(f"Error connecting to OpenRouter: {e}")
         
         # Explicit error messages for missing keys in specific modes
         elif self.mode == "GEMINI" and not self.gemini_key:
-            return "Gemini mode selected but no API key provided. Please check your settings."
+            raise ProviderError("Gemini mode selected but no API key provided. Please check your settings.")
         elif self.mode == "GROQ" and not self.groq_api_key:
-            return "Groq mode selected but no API key provided. Please check your settings."
+            raise ProviderError("Groq mode selected but no API key provided. Please check your settings.")
         elif self.mode == "CLOUD" and not self.openai_client:
-            return "Cloud/OpenAI mode selected but no API key provided. Please check your settings."
+            raise ProviderError("Cloud/OpenAI mode selected but no API key provided. Please check your settings.")
             
         else:
             # Local Ollama or similar using OpenAI-compatible API
             try:
-                response = requests.post(
-                    f"{self.local_base_url}/chat/completions",
-                    json={
-                        "model": self.local_model,
-                        "messages": [{"role": "user", "content": prompt}],
-                        "temperature": 0.7
-                    }
-                )
+                with timed_llm_call("local", self.local_model):
+                    response = requests.post(
+                        f"{self.local_base_url}/chat/completions",
+                        json={
+                            "model": self.local_model,
+                            "messages": [{"role": "user", "content": prompt}],
+                            "temperature": 0.7
+                        }
+                    )
                 if response.status_code == 200:
                     return response.json()["choices"][0]["message"]["content"]
                 else:
-                    return f"Error from local model: {response.text}"
+                    record_provider_error("local", self.local_model)
+                    raise ProviderError(f"Error from local model: {response.text}")
+            except ProviderError:
+                raise
             except Exception as e:
-                return f"Could not connect to local model at {self.local_base_url}. Is Ollama running? Error: {e}"
+                record_provider_error("local", self.local_model)
+                raise ProviderError(f"Could not connect to local model at {self.local_base_url}. Is Ollama running? Error: {e}")
+
+    def has_credentials(self, mode: str) -> bool:
+        return {
+            "CLOUD": self.openai_client is not None,
+            "OPENROUTER": bool(self.openrouter_api_key),
+            "GEMINI": bool(self.gemini_key),
+            "GROQ": bool(self.groq_api_key),
+            "ZOHO": bool(self.zoho_refresh_token),
+        }.get(mode, True)
+
+    def apply_settings(self, settings: Dict[str, Any], synced: bool = False):
+        # Always update the keys from the request; settings synced from other workers may leave them out
+        if settings.get("openai_key") is not None:
+            self.openai_client = OpenAI(api_key=settings["openai_key"]) if settings["openai_key"] else None
+            
+        if "openrouter_key" in settings:
+            self.openrouter_api_key = settings["openrouter_key"]
+        if "gemini_key" in settings:
+            self.gemini_key = settings["gemini_key"]
+        if "groq_key" in settings:
+            self.groq_api_key = settings["groq_key"]
+        
+        if settings.get("openrouter_model"):
+            self.openrouter_model = settings["openrouter_model"]
+        if settings.get("groq_model"):
+            self.groq_model = settings["groq_model"]
+        if settings.get("local_model"):
+            self.local_model = settings["local_model"]
+
+        # A worker picking up another worker's settings keeps its mode rather than switch to a provider it has no key for
+        if synced and not self.has_credentials(settings["mode"]):
+            print(f"Keeping {self.mode} mode: no API key available for {settings['mode']}")
+            return
+        self.mode = settings["mode"]
 
     def set_mode(self, mode: str):
         if mode in ["LOCAL", "CLOUD", "OPENROUTER", "GEMINI", "GROQ", "ZOHO"]:
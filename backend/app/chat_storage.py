@@ -1,68 +1,148 @@
 import json
 import os
+import sqlite3
 import uuid
+from contextlib import contextmanager
 from datetime import datetime
 from typing import List, Dict, Optional
+from .metrics import timed
 
-STORAGE_FILE = "chat_sessions.json"
+LEGACY_STORAGE_FILE = "chat_sessions.json"
+STATE_DB_FILE = "state.db"
+JSON_MIGRATED_KEY = "chat_sessions_json_migrated"
+
+def default_state_dir() -> str:
+    # Chat history and settings live outside the source tree, in ~/.litelabs unless LITELABS_DATA_DIR is set
+    return os.getenv("LITELABS_DATA_DIR") or os.path.join(os.path.expanduser("~"), ".litelabs")
+
+def state_db_path(storage_path: Optional[str] = None) -> str:
+    # Point STATE_DB at one file shared by every API worker so they see the same sessions and settings
+    if os.getenv("STATE_DB"):
+        return os.getenv("STATE_DB")
+    storage_path = storage_path or default_state_dir()
+    os.makedirs(storage_path, mode=0o700, exist_ok=True)
+    return os.path.join(storage_path, STATE_DB_FILE)
+
+def restrict_to_owner(db_path: str):
+    # The database holds API keys; SQLite gives its -wal/-shm files the same permissions
+    try:
+        os.close(os.open(db_path, os.O_CREAT | os.O_WRONLY, 0o600))
+        os.chmod(db_path, 0o600)
+    except OSError:
+        pass
+
+@contextmanager
+def connect(db_path: str):
+    # A short-lived connection per operation is safe across threads and processes
+    if not os.path.exists(db_path):
+        restrict_to_owner(db_path)
+    conn = sqlite3.connect(db_path, timeout=10)
+    try:
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
 
 class ChatStorage:
-    def __init__(self, storage_path: str = "."):
-        self.file_path = os.path.join(storage_path, STORAGE_FILE)
-        self.sessions = self._load()
+    def __init__(self, storage_path: Optional[str] = None, legacy_path: Optional[str] = None):
+        self.db_path = state_db_path(storage_path)
+        with connect(self.db_path) as conn:
+            # WAL needs a local filesystem: workers may share state.db on one machine, not over NFS
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, name TEXT NOT NULL, directory_path TEXT NOT NULL, created_at TEXT NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_directory ON sessions (directory_path)")
+            conn.execute("CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, role TEXT NOT NULL, content TEXT, sources TEXT NOT NULL, timestamp TEXT NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id)")
+            conn.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        # chat_sessions.json used to be written next to the code
+        self._migrate_json(os.path.join(legacy_path or storage_path or ".", LEGACY_STORAGE_FILE))
 
-    def _load(self) -> Dict:
-        if os.path.exists(self.file_path):
-            with open(self.file_path, 'r') as f:
-                return json.load(f)
-        return {"sessions": {}, "directory_map": {}}
+    def _migrate_json(self, file_path: str):
+        """Import sessions from the old chat_sessions.json file once, then move it aside."""
+        if not os.path.exists(file_path):
+            return
+        with connect(self.db_path) as conn:
+            # Every worker runs this at startup; the write lock and marker row let exactly one import
+            conn.execute("BEGIN IMMEDIATE")
+            done = conn.execute("SELECT 1 FROM info WHERE key = ?", (JSON_MIGRATED_KEY,)).fetchone()
+            if not done:
+                try:
+                    with open(file_path, 'r') as f:
+                        data = json.load(f)
+                except FileNotFoundError:
+                    return
+                self._import_sessions(conn, data)
+                conn.execute("INSERT INTO info (key, value) VALUES (?, ?)", (JSON_MIGRATED_KEY, datetime.now().isoformat()))
+        try:
+            os.replace(file_path, file_path + ".migrated")
+        except FileNotFoundError:
+            # Another worker already moved it
+            pass
 
-    def _save(self):
-        with open(self.file_path, 'w') as f:
-            json.dump(self.sessions, f, indent=2)
+    @staticmethod
+    def _import_sessions(conn, data: Dict):
+        for session in data.get("sessions", {}).values():
+            conn.execute(
+                "INSERT OR IGNORE INTO sessions (id, name, directory_path, created_at) VALUES (?, ?, ?, ?)",
+                (session["id"], session["name"], session["directory_path"], session["created_at"])
+            )
+            for message in session.get("messages", []):
+                conn.execute(
+                    "INSERT INTO messages (session_id, role, content, sources, timestamp) VALUES (?, ?, ?, ?, ?)",
+                    (session["id"], message["role"], message["content"], json.dumps(message.get("sources", [])), message["timestamp"])
+                )
 
     def create_session(self, directory_path: str, name: Optional[str] = None) -> str:
         session_id = str(uuid.uuid4())
         timestamp = datetime.now().isoformat()
-        
-        session = {
-            "id": session_id,
-            "name": name or f"Chat {timestamp[:16]}",
-            "directory_path": directory_path,
-            "created_at": timestamp,
-            "messages": []
-        }
-        
-        self.sessions["sessions"][session_id] = session
-        
-        if directory_path not in self.sessions["directory_map"]:
-            self.sessions["directory_map"][directory_path] = []
-        self.sessions["directory_map"][directory_path].append(session_id)
-        
-        self._save()
+
+        with timed("storage_write"), connect(self.db_path) as conn:
+            conn.execute(
+                "INSERT INTO sessions (id, name, directory_path, created_at) VALUES (?, ?, ?, ?)",
+                (session_id, name or f"Chat {timestamp[:16]}", directory_path, timestamp)
+            )
         return session_id
 
+    def _load_sessions(self, conn, rows) -> List[Dict]:
+        sessions = []
+        for session_id, name, directory_path, created_at in rows:
+            messages = conn.execute(
+                "SELECT role, content, sources, timestamp FROM messages WHERE session_id = ? ORDER BY id", (session_id,)
+            ).fetchall()
+            sessions.append({
+                "id": session_id,
+                "name": name,
+                "directory_path": directory_path,
+                "created_at": created_at,
+                "messages": [
+                    {"role": role, "content": content, "sources": json.loads(sources), "timestamp": timestamp}
+                    for role, content, sources, timestamp in messages
+                ]
+            })
+        return sessions
+
     def get_sessions_for_directory(self, directory_path: str) -> List[Dict]:
-        session_ids = self.sessions["directory_map"].get(directory_path, [])
-        return [self.sessions["sessions"][sid] for sid in session_ids if sid in self.sessions["sessions"]]
+        with connect(self.db_path) as conn:
+            rows = conn.execute(
+                "SELECT id, name, directory_path, created_at FROM sessions WHERE directory_path = ? ORDER BY created_at", (directory_path,)
+            ).fetchall()
+            return self._load_sessions(conn, rows)
 
     def add_message(self, session_id: str, role: str, content: str, sources: Optional[List[str]] = None):
-        if session_id in self.sessions["sessions"]:
-            self.sessions["sessions"][session_id]["messages"].append({
-                "role": role,
-                "content": content,
-                "sources": sources or [],
-                "timestamp": datetime.now().isoformat()
-            })
-            self._save()
+        with timed("storage_write"), connect(self.db_path) as conn:
+            # The sub-select keeps this a no-op for unknown sessions, as before
+            conn.execute(
+                "INSERT INTO messages (session_id, role, content, sources, timestamp) SELECT id, ?, ?, ?, ? FROM sessions WHERE id = ?",
+                (role, content, json.dumps(sources or []), datetime.now().isoformat(), session_id)
+            )
 
     def get_session(self, session_id: str) -> Optional[Dict]:
-        return self.sessions["sessions"].get(session_id)
+        with connect(self.db_path) as conn:
+            rows = conn.execute("SELECT id, name, directory_path, created_at FROM sessions WHERE id = ?", (session_id,)).fetchall()
+            sessions = self._load_sessions(conn, rows)
+        return sessions[0] if sessions else None
 
     def delete_session(self, session_id: str):
-        if session_id in self.sessions["sessions"]:
-            session = self.sessions["sessions"].pop(session_id)
-            dir_path = session["directory_path"]
-            if dir_path in self.sessions["directory_map"]:
-                self.sessions["directory_map"][dir_path].remove(session_id)
-            self._save()
+        with timed("storage_write"), connect(self.db_path) as conn:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
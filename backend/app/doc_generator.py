@@ -1,22 +1,20 @@
 from fpdf import FPDF
 from docx import Document
-import os
+import io
 
 class DocumentGenerator:
     @staticmethod
-    def generate_pdf(content: str, filename: str = "report.pdf"):
+    def render_pdf(content: str) -> bytes:
         pdf = FPDF()
         pdf.add_page()
         pdf.set_font("Arial", size=12)
         pdf.multi_cell(0, 10, content)
-        path = os.path.join(os.getcwd(), filename)
-        pdf.output(path)
-        return path
+        return bytes(pdf.output())
 
     @staticmethod
-    def generate_docx(content: str, filename: str = "report.docx"):
+    def render_docx(content: str) -> bytes:
         doc = Document()
         doc.add_paragraph(content)
-        path = os.path.join(os.getcwd(), filename)
-        doc.save(path)
-        return path
+        buffer = io.BytesIO()
+        doc.save(buffer)
+        return buffer.getvalue()
@@ -0,0 +1,238 @@
+import asyncio
+import heapq
+import itertools
+import os
+import re
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Mapping, Optional
+from .metrics import SCHEDULER_QUEUE_DEPTH, SCHEDULER_REJECTIONS, SCHEDULER_WAIT
+
+INTERACTIVE = 0
+BATCH = 1
+
+# Free-tier defaults (requests/min, tokens/min); overridden by <PROVIDER>_RPM / <PROVIDER>_TPM
+# and refined from rate limit headers as responses come back
+DEFAULT_LIMITS = {
+    "groq": (30, 6000),
+    "openrouter": (20, 100000),
+    "gemini": (15, 1000000),
+    "openai": (500, 30000),
+}
+# Groq's x-ratelimit-*-requests headers describe the daily quota, so only its token headers size the buckets
+DAILY_REQUEST_HEADERS = {"groq"}
+
+class ProviderBusy(Exception):
+    """Raised when a request can't get a provider slot before its queue deadline."""
+
+    def __init__(self, provider: str, retry_after: float):
+        super().__init__(f"{provider} is rate limited right now. Please try again in {retry_after:.0f}s.")
+        self.provider = provider
+        self.retry_after = retry_after
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """Seconds until reset from headers like '7.66s', '2m59.56s', '120ms' or a unix timestamp in ms."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        number = float(value)
+        # OpenRouter sends an epoch timestamp in milliseconds
+        return max(number / 1000 - time.time(), 0) if number > 1e11 else number
+    except ValueError:
+        pass
+    total = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total
+
+class TokenBucket:
+    def __init__(self, capacity: float, per_minute: float):
+        self.capacity = capacity
+        self.rate = per_minute / 60.0
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        # Never ask for more than the bucket can ever hold
+        missing = min(amount, self.capacity) - self.tokens
+        return max(missing / self.rate, 0.0) if self.rate > 0 else float("inf")
+
+class ProviderLimiter:
+    def __init__(self, name: str, rpm: float, tpm: float):
+        self.name = name
+        self.requests = TokenBucket(rpm, rpm)
+        self.tokens = TokenBucket(tpm, tpm)
+        self.blocked_until = 0.0
+        self.queue = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    def wait_time(self, cost: float, now: float) -> float:
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        return max(self.blocked_until - now, self.requests.wait_time(1), self.tokens.wait_time(cost), 0.0)
+
+    def take(self, cost: float):
+        self.requests.tokens -= 1
+        self.tokens.tokens -= min(cost, self.tokens.capacity)
+
+    def give_back(self, cost: float):
+        # For a slot that was granted but never used
+        self.requests.tokens = min(self.requests.capacity, self.requests.tokens + 1)
+        self.tokens.tokens = min(self.tokens.capacity, self.tokens.tokens + min(cost, self.tokens.capacity))
+
+class LLMScheduler:
+    """Per-provider token buckets with a priority queue in front of them.
+
+    Waiters are served highest priority first, then in arrival order. A waiter whose deadline passes,
+    or who clearly can't be served before it, gets ProviderBusy instead of piling onto a throttled provider.
+    """
+
+    def __init__(self):
+        self.limiters: Dict[str, ProviderLimiter] = {}
+        self.lock = threading.Lock()
+        self.sequence = itertools.count()
+
+    def limiter(self, provider: str) -> ProviderLimiter:
+        with self.lock:
+            limiter = self.limiters.get(provider)
+            if limiter is None:
+                rpm, tpm = DEFAULT_LIMITS.get(provider, (60, 100000))
+                rpm = float(os.getenv(f"{provider.upper()}_RPM", rpm))
+                tpm = float(os.getenv(f"{provider.upper()}_TPM", tpm))
+                limiter = ProviderLimiter(provider, rpm, tpm)
+                self.limiters[provider] = limiter
+            return limiter
+
+    def _estimated_wait(self, limiter: ProviderLimiter, priority: int, cost: float, now: float) -> float:
+        # Requests already queued at the same or higher priority are served first
+        ahead = [w for w in limiter.queue if not w[3].done() and w[0] <= priority]
+        request_wait = (len(ahead) + 1 - limiter.requests.tokens) / limiter.requests.rate if limiter.requests.rate > 0 else float("inf")
+        token_wait = (sum(w[2] for w in ahead) + cost - limiter.tokens.tokens) / limiter.tokens.rate if limiter.tokens.rate > 0 else float("inf")
+        return max(limiter.blocked_until - now, request_wait, token_wait, 0.0)
+
+    def _dispatch(self, limiter: ProviderLimiter):
+        if limiter.timer is not None:
+            limiter.timer.cancel()
+            limiter.timer = None
+        now = time.monotonic()
+        with self.lock:
+            while limiter.queue:
+                priority, _, cost, future = limiter.queue[0]
+                if future.done():
+                    heapq.heappop(limiter.queue)
+                    continue
+                wait = limiter.wait_time(cost, now)
+                if wait > 0:
+                    break
+                heapq.heappop(limiter.queue)
+                limiter.take(cost)
+                future.set_result(None)
+            SCHEDULER_QUEUE_DEPTH.labels(provider=limiter.name).set(len(limiter.queue))
+            if limiter.queue:
+                head_cost = limiter.queue[0][2]
+                wait = limiter.wait_time(head_cost, now)
+        if limiter.queue and limiter.timer is None:
+            limiter.timer = asyncio.get_running_loop().call_later(wait, self._dispatch, limiter)
+
+    @asynccontextmanager
+    async def slot(self, provider: Optional[str], cost: float, priority: int = INTERACTIVE, timeout: Optional[float] = None):
+        if provider is None:
+            yield
+            return
+        limiter = self.limiter(provider)
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        with self.lock:
+            limiter.wait_time(cost, now)
+            expected = self._estimated_wait(limiter, priority, cost, now)
+            if timeout is not None and expected > timeout:
+                SCHEDULER_REJECTIONS.labels(provider=provider).inc()
+                raise ProviderBusy(provider, expected)
+            future = loop.create_future()
+            heapq.heappush(limiter.queue, (priority, next(self.sequence), cost, future))
+        self._dispatch(limiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            # The slot may have been granted just as the deadline passed
+            if not future.done() or future.cancelled():
+                future.cancel()
+                self._dispatch(limiter)
+                SCHEDULER_REJECTIONS.labels(provider=provider).inc()
+                raise ProviderBusy(provider, self._estimated_wait(limiter, priority, cost, time.monotonic()))
+        except asyncio.CancelledError:
+            # The caller went away (failed export, disconnected client): leave the queue without spending budget
+            with self.lock:
+                if future.done() and not future.cancelled():
+                    limiter.give_back(cost)
+                else:
+                    future.cancel()
+            self._dispatch(limiter)
+            raise
+        SCHEDULER_WAIT.labels(provider=provider).observe(time.monotonic() - now)
+        yield
+
+    def try_acquire(self, provider: str, cost: float) -> float:
+        """Charge an extra call (e.g. a fallback model) to the provider if it can go right now.
+
+        Returns 0 when the call was charged, otherwise the seconds until it could go. Waiters already
+        queued for the provider go first. Safe to call from worker threads.
+        """
+        limiter = self.limiter(provider)
+        now = time.monotonic()
+        with self.lock:
+            wait = limiter.wait_time(cost, now)
+            if wait == 0 and any(not w[3].done() for w in limiter.queue):
+                wait = self._estimated_wait(limiter, INTERACTIVE, cost, now) or 1.0
+            if wait > 0:
+                return wait
+            limiter.take(cost)
+            return 0.0
+
+    def observe(self, provider: Optional[str], status_code: int, headers: Mapping[str, str]):
+        """Learn limits from a provider response. Safe to call from worker threads."""
+        if provider is None:
+            return
+        limiter = self.limiter(provider)
+        headers = {k.lower(): v for k, v in headers.items()}
+        now = time.monotonic()
+        with self.lock:
+            # Groq/OpenAI send per-kind headers; OpenRouter sends a single requests limit
+            for kind, bucket in (("requests", limiter.requests), ("tokens", limiter.tokens)):
+                limit = headers.get(f"x-ratelimit-limit-{kind}") or (headers.get("x-ratelimit-limit") if kind == "requests" else None)
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}") or (headers.get("x-ratelimit-remaining") if kind == "requests" else None)
+                reset = parse_reset(headers.get(f"x-ratelimit-reset-{kind}") or (headers.get("x-ratelimit-reset") if kind == "requests" else None))
+                daily = kind == "requests" and provider in DAILY_REQUEST_HEADERS
+                try:
+                    if limit and not daily:
+                        if kind == "tokens":
+                            # Token limits are per minute for every provider we talk to
+                            bucket.rate = float(limit) / 60.0
+                        else:
+                            # Request headers may only tighten the configured RPM
+                            bucket.rate = min(bucket.rate, float(limit) / 60.0)
+                        # Never allow a burst larger than one minute of refill
+                        bucket.capacity = min(float(limit), bucket.rate * 60.0)
+                        bucket.tokens = min(bucket.tokens, bucket.capacity)
+                    if remaining is not None:
+                        if not daily:
+                            bucket.refill(now)
+                            bucket.tokens = min(bucket.tokens, float(remaining))
+                        # An exhausted daily quota still blocks until it resets
+                        if float(remaining) <= 0 and reset:
+                            limiter.blocked_until = max(limiter.blocked_until, now + reset)
+                except ValueError:
+                    continue
+            if status_code == 429:
+                retry_after = parse_reset(headers.get("retry-after")) or 5.0
+                limiter.blocked_until = max(limiter.blocked_until, now + retry_after)
+
+def estimate_tokens(text: str, completion_tokens: int = 512) -> int:
+    # Roughly four characters per token for English text, plus room for the answer
+    return len(text) // 4 + completion_tokens
@@ -1,18 +1,24 @@
-from fastapi import FastAPI, Depends, HTTPException, status, BackgroundTasks
+from fastapi import FastAPI, Depends, HTTPException, status, BackgroundTasks, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
+import io
 import os
-from .rag_engine import RAGEngine
+import time
+from .rag_engine import RAGEngine, result_sources
 from .parsers import DocumentParser
-from .chat_engine import ChatEngine
+from .chat_engine import ChatEngine, ProviderError
+from .llm_scheduler import ProviderBusy, INTERACTIVE
 from .doc_generator import DocumentGenerator
 from .chat_storage import ChatStorage
+from .settings_store import SettingsStore
+from .report_builder import ReportBuilder
+from . import metrics
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 import bcrypt
-from fastapi.responses import FileResponse
+from fastapi.responses import Response, StreamingResponse
 
 # Configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "mcp-lite-labs-secret-key-change-me")
@@ -29,6 +35,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_request_timings(request: Request, call_next):
+    # Pick up settings changed through any worker before handling the request
+    sync_settings()
+    token = metrics.start_request_timings()
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        metrics.finish_request_timings(token, request.method, request.url.path, status_code, time.perf_counter() - start)
+
 # Removed Passlib CryptContext due to bcrypt 4.0 conflict
 # pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -60,10 +80,24 @@ class SettingsRequest(BaseModel):
     groq_model: Optional[str] = None
     local_model: Optional[str] = None
 
-# In-memory session or could use SQLite for more persistence
+# Sessions and settings live in a shared SQLite database (STATE_DB, default ~/.litelabs/state.db)
+# so any number of workers stay consistent
 rag_engine = RAGEngine()
 chat_engine = ChatEngine()
-chat_storage = ChatStorage(storage_path=os.path.dirname(os.path.abspath(__file__)))
+chat_storage = ChatStorage(legacy_path=os.path.dirname(os.path.abspath(__file__)))
+settings_store = SettingsStore()
+
+def sync_settings():
+    settings = settings_store.poll()
+    if settings:
+        chat_engine.apply_settings(settings, synced=True)
+report_builder = ReportBuilder(
+    chat_engine,
+    max_concurrency=int(os.getenv("EXPORT_CONCURRENCY", "4")),
+    queue_timeout=float(os.getenv("EXPORT_QUEUE_TIMEOUT", "120")),
+)
+# Seconds an interactive query may wait for a provider slot before failing fast
+QUERY_QUEUE_TIMEOUT = float(os.getenv("QUERY_QUEUE_TIMEOUT", "15"))
 
 # Mock user for local access
 # Password: admin123
@@ -112,16 +146,33 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
+def run_index_job(directory_path: str):
+    try:
+        rag_engine.index_directory(directory_path)
+    finally:
+        metrics.INDEX_QUEUE_DEPTH.dec()
+
 @app.post("/index")
 async def index_data(request: IndexRequest, background_tasks: BackgroundTasks):
     if not os.path.exists(request.directory_path):
         raise HTTPException(status_code=400, detail="Path does not exist")
     
     # Run indexing in background to avoid blocking
-    background_tasks.add_task(rag_engine.index_directory, request.directory_path)
+    metrics.INDEX_QUEUE_DEPTH.inc()
+    background_tasks.add_task(run_index_job, request.directory_path)
     
     return {"status": "success", "message": f"Started indexing {request.directory_path} in the background"}
 
+@app.delete("/index")
+async def drop_index(directory_path: str):
+    if not rag_engine.drop_directory(directory_path):
+        raise HTTPException(status_code=404, detail="Directory is not indexed")
+    return {"status": "success", "message": f"Dropped index for {directory_path}"}
+
+@app.get("/indexes")
+async def list_indexes():
+    return {"directories": rag_engine.indexed_directories()}
+
 @app.post("/query")
 async def query_documents(request: QueryRequest):
     actual_query = request.query or request.text
@@ -131,12 +182,18 @@ async def query_documents(request: QueryRequest):
     results = rag_engine.query(actual_query, directory_path=request.directory_path)
     
     # Generate context from search results
-    context = "\n\n".join([f"Source: {res['metadata']['source']}\nContent: {res['content']}" for res in results])
+    with metrics.timed("prompt_assembly"):
+        context = "\n\n".join([f"Source: {res['metadata']['source']}\nContent: {res['content']}" for res in results])
     
-    # Generate response using ChatEngine
-    response = await chat_engine.generate_response(actual_query, context)
+    # Generate response using ChatEngine; failures are reported as errors, not saved as answers
+    try:
+        response = await chat_engine.generate_response(actual_query, context, raise_errors=True, priority=INTERACTIVE, timeout=QUERY_QUEUE_TIMEOUT)
+    except ProviderBusy as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
+    except ProviderError as e:
+        raise HTTPException(status_code=502, detail=str(e))
     
-    sources = [res['metadata']['source'] for res in results]
+    sources = list(dict.fromkeys(source for res in results for source in result_sources(res)))
     
     # Save to storage if session_id and directory_path provided
     if request.session_id and request.directory_path:
@@ -171,47 +228,50 @@ async def delete_session(session_id: str):
 
 @app.post("/export")
 async def export_document(request: QueryRequest, format: str = "pdf"):
-    # Reuse query logic to get content for export
-    results = rag_engine.query(request.text)
-    context = "\n\n".join([f"Source: {res['metadata']['source']}\nContent: {res['content']}" for res in results])
+    focus = request.query or request.text
+    # Whole directory when one is given, otherwise the documents most relevant to the request
+    if request.directory_path:
+        documents = rag_engine.get_directory_documents(request.directory_path)
+    elif focus:
+        documents = rag_engine.query(focus, n_results=20)
+    else:
+        raise HTTPException(status_code=400, detail="Query, text or directory_path must be provided")
+    if not documents:
+        raise HTTPException(status_code=404, detail="No indexed documents to export")
     
-    # Generate a report using the content
-    prompt = f"Summarize these documents into a professional report: {context}"
-    report_content = await chat_engine.generate_response(prompt, context)
+    try:
+        report_content = await report_builder.build(documents, focus=focus or "")
+    except ProviderBusy as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
+    except ProviderError as e:
+        raise HTTPException(status_code=502, detail=str(e))
     
     if format == "pdf":
-        path = DocumentGenerator.generate_pdf(report_content)
+        data = DocumentGenerator.render_pdf(report_content)
     else:
-        path = DocumentGenerator.generate_docx(report_content)
+        format = "docx"
+        data = DocumentGenerator.render_docx(report_content)
         
-    return FileResponse(path, filename=f"report.{format}", media_type='application/octet-stream')
+    return StreamingResponse(
+        io.BytesIO(data),
+        media_type='application/octet-stream',
+        headers={"Content-Disposition": f'attachment; filename="report.{format}"'}
+    )
 
 @app.get("/files")
-async def list_indexed_files():
-    docs = rag_engine.get_all_documents()
+async def list_indexed_files(directory_path: Optional[str] = None):
+    docs = rag_engine.get_all_documents(directory_path)
     files = set()
     if docs['metadatas']:
         for meta in docs['metadatas']:
-            files.add(meta['filename'])
+            for source in result_sources({"metadata": meta}):
+                files.add(os.path.basename(source))
     return {"files": list(files)}
 
 @app.post("/settings")
 async def update_settings(request: SettingsRequest):
-    chat_engine.mode = request.mode
-    # Always update the keys from the request
-    if request.openai_key is not None:
-        chat_engine.openai_client = OpenAI(api_key=request.openai_key) if request.openai_key else None
-        
-    chat_engine.openrouter_api_key = request.openrouter_key
-    chat_engine.gemini_key = request.gemini_key
-    chat_engine.groq_api_key = request.groq_key
-    
-    if request.openrouter_model:
-        chat_engine.openrouter_model = request.openrouter_model
-    if request.groq_model:
-        chat_engine.groq_model = request.groq_model
-    if request.local_model:
-        chat_engine.local_model = request.local_model
+    settings_store.save(request.dict())
+    chat_engine.apply_settings(request.dict())
     return {"status": "success", "message": f"Mode set to {request.mode}"}
 
 @app.get("/browse")
@@ -246,6 +306,11 @@ async def browse_directory(path: Optional[str] = None):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    data, content_type = metrics.render_latest()
+    return Response(content=data, media_type=content_type)
+
 @app.get("/health")
 async def health_check():
     return {"status": "ok", "timestamp": datetime.now()}
@@ -2,14 +2,19 @@ import asyncio
 from mcp.server import Server
 from mcp.server.models import InitializationOptions
 import mcp.types as types
-from .rag_engine import RAGEngine
+from .rag_engine import RAGEngine, result_sources
 from .parsers import DocumentParser
+import json
 import os
 
 # Initialize MCP Server
 server = Server("mcp-lite-labs-server")
 rag_engine = RAGEngine()
 
+# Reads without an explicit limit are capped so one call can't flood the stdio channel
+MAX_READ_CHARS = int(os.getenv("MCP_MAX_READ_CHARS", "100000"))
+MAX_READ_LINES = int(os.getenv("MCP_MAX_READ_LINES", "2000"))
+
 @server.list_tools()
 async def handle_list_tools() -> list[types.Tool]:
     """List available tools for the AI agent."""
@@ -26,6 +31,18 @@ async def handle_list_tools() -> list[types.Tool]:
                 "required": ["query"]
             }
         ),
+        types.Tool(
+            name="search_documents_batch",
+            description="Run several semantic searches at once. Faster than calling search_documents repeatedly.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "queries": {"type": "array", "items": {"type": "string"}, "description": "The search queries"},
+                    "n_results": {"type": "integer", "description": "Number of results to return per query", "default": 5}
+                },
+                "required": ["queries"]
+            }
+        ),
         types.Tool(
             name="index_directory",
             description="Index a local directory for search",
@@ -39,7 +56,25 @@ async def handle_list_tools() -> list[types.Tool]:
         ),
         types.Tool(
             name="read_document",
-            description="Read the full content of a specified document",
+            description="Read the content of a document, optionally a slice of it. Use document_info first for large files.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "path": {"type": "string", "description": "Absolute path to the file"},
+                    "offset": {"type": "integer", "minimum": 0, "description": "Where to start reading, in `unit`s (within the selected pages or rows)", "default": 0},
+                    "limit": {"type": "integer", "minimum": 1, "description": f"How many `unit`s to read (at most {MAX_READ_CHARS} chars/bytes or {MAX_READ_LINES} lines)"},
+                    "unit": {"type": "string", "enum": ["chars", "lines", "bytes"], "default": "chars"},
+                    "start_page": {"type": "integer", "description": "First PDF page to read (1-based)"},
+                    "end_page": {"type": "integer", "description": "Last PDF page to read (inclusive)"},
+                    "start_row": {"type": "integer", "description": "First spreadsheet data row to read (0-based)"},
+                    "end_row": {"type": "integer", "description": "Spreadsheet row to stop before"}
+                },
+                "required": ["path"]
+            }
+        ),
+        types.Tool(
+            name="document_info",
+            description="Get the size of a document (bytes, lines, pages or rows) without reading its content",
             inputSchema={
                 "type": "object",
                 "properties": {
@@ -50,6 +85,9 @@ async def handle_list_tools() -> list[types.Tool]:
         )
     ]
 
+def format_results(results: list) -> str:
+    return "\n\n".join([f"Source: {', '.join(result_sources(res))}\nContent: {res['content']}" for res in results])
+
 @server.call_tool()
 async def handle_call_tool(
     name: str, 
@@ -62,24 +100,65 @@ async def handle_call_tool(
     if name == "search_documents":
         query = arguments.get("query")
         n = arguments.get("n_results", 5)
-        results = rag_engine.query(query, n_results=n)
-        response_text = "\n\n".join([f"Source: {res['metadata']['source']}\nContent: {res['content']}" for res in results])
-        return [types.TextContent(type="text", text=response_text)]
+        # Blocking work runs in a thread so concurrent tool calls don't serialize
+        results = await asyncio.to_thread(rag_engine.query, query, n_results=n)
+        return [types.TextContent(type="text", text=format_results(results))]
+
+    elif name == "search_documents_batch":
+        queries = arguments.get("queries") or []
+        n = arguments.get("n_results", 5)
+        if not queries:
+            return [types.TextContent(type="text", text="No queries provided")]
+        batch = await asyncio.to_thread(rag_engine.query_batch, queries, n_results=n)
+        sections = [f"## Query: {query}\n\n{format_results(results)}" for query, results in zip(queries, batch)]
+        return [types.TextContent(type="text", text="\n\n".join(sections))]
 
     elif name == "index_directory":
         path = arguments.get("path")
         if not os.path.exists(path):
             return [types.TextContent(type="text", text=f"Path {path} does not exist")]
-        rag_engine.index_directory(path)
+        await asyncio.to_thread(rag_engine.index_directory, path)
         return [types.TextContent(type="text", text=f"Successfully indexed {path}")]
 
     elif name == "read_document":
         path = arguments.get("path")
-        content = DocumentParser.parse(path)
-        if content:
-            return [types.TextContent(type="text", text=content)]
-        else:
+        offset = arguments.get("offset") or 0
+        unit = arguments.get("unit", "chars")
+        requested = arguments.get("limit")
+        if offset < 0 or (requested is not None and requested <= 0):
+            return [types.TextContent(type="text", text="offset must be 0 or more and limit must be at least 1")]
+        # Every read is capped so one call can't return a whole multi-hundred-MB file
+        cap = MAX_READ_LINES if unit == "lines" else MAX_READ_CHARS
+        limit = min(requested or cap, cap)
+        ranges = {key: arguments.get(key) for key in ("start_page", "end_page", "start_row", "end_row")}
+        result = await asyncio.to_thread(DocumentParser.read_range, path, offset=offset, limit=limit, unit=unit, **ranges)
+        if result is None:
             return [types.TextContent(type="text", text=f"Could not parse file at {path}")]
+        content, next_offset = result
+        if not content:
+            return [types.TextContent(type="text", text=f"[End of document: nothing to read at offset={offset} {unit}.]")]
+        hint = f"Call read_document again with the same arguments and offset={next_offset} to continue."
+        if unit == "lines" and len(content) > MAX_READ_CHARS:
+            # Long lines can still blow past the char cap; keep whole lines where possible
+            cut = content.rfind("\n", 0, MAX_READ_CHARS) + 1
+            if cut:
+                content, next_offset = content[:cut], offset + content.count("\n", 0, cut)
+                hint = f"Call read_document again with the same arguments and offset={next_offset} to continue."
+            else:
+                # A single line is over the cap; the rest of it can only be reached by characters
+                line_start = await asyncio.to_thread(DocumentParser.line_char_offset, path, offset, **ranges)
+                content, next_offset = content[:MAX_READ_CHARS], offset + 1
+                hint = (f"Line {offset} is longer than {MAX_READ_CHARS} chars and was cut. Read the rest of it with "
+                        f"unit=\"chars\" and offset={line_start + MAX_READ_CHARS}, or continue with the next line at offset={next_offset}.")
+        if next_offset is not None:
+            content += f"\n\n[Truncated. {hint}]"
+        return [types.TextContent(type="text", text=content)]
+
+    elif name == "document_info":
+        path = arguments.get("path")
+        if not os.path.exists(path):
+            return [types.TextContent(type="text", text=f"Path {path} does not exist")]
+        return [types.TextContent(type="text", text=json.dumps(await asyncio.to_thread(DocumentParser.stat, path)))]
 
     raise ValueError(f"Unknown tool: {name}")
 
@@ -0,0 +1,140 @@
+import contextvars
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+
+# Set TIMING_LOGS=1 to emit one JSON line per request with its stage timings
+TIMING_LOGS_ENABLED = os.getenv("TIMING_LOGS", "0").lower() in ("1", "true", "yes")
+
+timing_logger = logging.getLogger("litelabs.timing")
+if TIMING_LOGS_ENABLED and not timing_logger.handlers:
+    timing_logger.addHandler(logging.StreamHandler())
+    timing_logger.setLevel(logging.INFO)
+
+STAGE_LATENCY = Histogram(
+    "litelabs_stage_duration_seconds",
+    "Time spent in each stage of request handling",
+    ["stage"],
+)
+LLM_LATENCY = Histogram(
+    "litelabs_llm_request_duration_seconds",
+    "Time spent waiting on an LLM provider, per model attempted",
+    ["provider", "model"],
+    buckets=(0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120),
+)
+PROVIDER_ERRORS = Counter(
+    "litelabs_provider_errors_total",
+    "LLM provider calls that failed",
+    ["provider", "model"],
+)
+PROVIDER_FALLBACKS = Counter(
+    "litelabs_provider_fallbacks_total",
+    "Fallback models attempted after the primary model failed",
+    ["provider", "model"],
+)
+INDEX_QUEUE_DEPTH = Gauge(
+    "litelabs_index_queue_depth",
+    "Indexing jobs scheduled or running",
+    multiprocess_mode="livesum",
+)
+INDEX_FILES_PER_SECOND = Gauge(
+    "litelabs_index_files_per_second",
+    "Throughput of the most recent indexing run",
+    multiprocess_mode="max",
+)
+INDEXED_FILES = Counter(
+    "litelabs_indexed_files_total",
+    "Files parsed and added to the vector store",
+)
+DEDUPLICATED_FILES = Counter(
+    "litelabs_deduplicated_files_total",
+    "Files skipped during indexing because identical content was already parsed",
+)
+DEDUPLICATED_CHUNKS = Counter(
+    "litelabs_deduplicated_chunks_total",
+    "Chunks not embedded because identical content is already stored",
+)
+PARSE_FAILURES = Counter(
+    "litelabs_parse_failures_total",
+    "Files that raised an error while parsing",
+    ["extension"],
+)
+
+SCHEDULER_QUEUE_DEPTH = Gauge(
+    "litelabs_llm_queue_depth",
+    "LLM calls waiting for a provider rate limit slot",
+    ["provider"],
+    multiprocess_mode="livesum",
+)
+SCHEDULER_WAIT = Histogram(
+    "litelabs_llm_queue_wait_seconds",
+    "Time LLM calls spent waiting for a provider rate limit slot",
+    ["provider"],
+)
+SCHEDULER_REJECTIONS = Counter(
+    "litelabs_llm_queue_rejections_total",
+    "LLM calls rejected because no slot was available before their deadline",
+    ["provider"],
+)
+
+# Stage timings collected for the request currently being handled
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+@contextmanager
+def timed(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.labels(stage=stage).observe(elapsed)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+@contextmanager
+def timed_llm_call(provider: str, model: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        LLM_LATENCY.labels(provider=provider, model=model).observe(time.perf_counter() - start)
+
+def record_provider_error(provider: str, model: str):
+    PROVIDER_ERRORS.labels(provider=provider, model=model).inc()
+
+def record_fallback(provider: str, model: str):
+    PROVIDER_FALLBACKS.labels(provider=provider, model=model).inc()
+
+def record_parse_failure(file_path: str):
+    ext = os.path.splitext(file_path)[1].lower() or "none"
+    PARSE_FAILURES.labels(extension=ext).inc()
+
+def start_request_timings() -> contextvars.Token:
+    return _request_timings.set({})
+
+def finish_request_timings(token: contextvars.Token, method: str, path: str, status_code: int, total: float):
+    timings = _request_timings.get() or {}
+    _request_timings.reset(token)
+    if TIMING_LOGS_ENABLED:
+        timing_logger.info(json.dumps({
+            "method": method,
+            "path": path,
+            "status": status_code,
+            "total_ms": round(total * 1000, 2),
+            "stages_ms": {k: round(v * 1000, 2) for k, v in timings.items()},
+        }))
+
+def render_latest():
+    # With several workers, set PROMETHEUS_MULTIPROC_DIR so /metrics aggregates all of them
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
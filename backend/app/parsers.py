@@ -1,11 +1,16 @@
+import mmap
 import os
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 import pypdf
 from docx import Document
 import pandas as pd
 from PIL import Image
 import pytesseract
 import markdown
+from .metrics import record_parse_failure
+
+TEXT_EXTENSIONS = ['.txt', '.log', '.md', '.markdown']
+SPREADSHEET_EXTENSIONS = ['.csv', '.xlsx']
 
 class DocumentParser:
     @staticmethod
@@ -14,12 +19,51 @@ class DocumentParser:
             return f.read()
 
     @staticmethod
-    def parse_pdf(file_path: str) -> str:
+    def read_text_range(file_path: str, offset: int = 0, limit: Optional[int] = None, unit: str = "chars") -> str:
+        """Read a slice of a text file without loading the rest of it."""
+        if unit == "bytes":
+            with open(file_path, 'rb') as f:
+                f.seek(offset)
+                data = f.read(limit) if limit is not None else f.read()
+            return data.decode('utf-8', errors='replace')
+        if unit == "lines":
+            if os.path.getsize(file_path) == 0:
+                return ""
+            with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                start = 0
+                for _ in range(offset):
+                    start = mm.find(b"\n", start) + 1
+                    if start == 0:
+                        return ""
+                end = start
+                for _ in range(limit if limit is not None else 0):
+                    end = mm.find(b"\n", end) + 1
+                    if end == 0:
+                        end = len(mm)
+                        break
+                if limit is None:
+                    end = len(mm)
+                return mm[start:end].decode('utf-8', errors='replace')
+        # Character offsets can't be mapped to bytes for UTF-8, so skip ahead in fixed-size blocks
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+            remaining = offset
+            while remaining > 0:
+                skipped = len(f.read(min(remaining, 1 << 20)))
+                if not skipped:
+                    return ""
+                remaining -= skipped
+            return f.read(limit) if limit is not None else f.read()
+
+    @staticmethod
+    def parse_pdf(file_path: str, start_page: Optional[int] = None, end_page: Optional[int] = None) -> str:
         text = ""
         with open(file_path, 'rb') as f:
             reader = pypdf.PdfReader(f)
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
+            # Pages are 1-based and inclusive; pypdf only parses the pages we touch
+            start = max((start_page or 1) - 1, 0)
+            end = min(end_page or len(reader.pages), len(reader.pages))
+            for i in range(start, end):
+                text += reader.pages[i].extract_text() + "\n"
         return text
 
     @staticmethod
@@ -35,14 +79,166 @@ class DocumentParser:
             return md_content
 
     @staticmethod
-    def parse_spreadsheet(file_path: str) -> str:
-        df = pd.read_excel(file_path) if file_path.endswith('.xlsx') else pd.read_csv(file_path)
+    def parse_spreadsheet(file_path: str, start_row: Optional[int] = None, end_row: Optional[int] = None) -> str:
+        # Rows are 0-based data rows (header excluded), end_row exclusive
+        kwargs = {}
+        if start_row:
+            kwargs["skiprows"] = range(1, start_row + 1)
+        if end_row is not None:
+            kwargs["nrows"] = max(end_row - (start_row or 0), 0)
+        df = pd.read_excel(file_path, **kwargs) if file_path.endswith('.xlsx') else pd.read_csv(file_path, **kwargs)
         return df.to_string()
 
     @staticmethod
     def parse_image(file_path: str) -> str:
         return pytesseract.image_to_string(Image.open(file_path))
 
+    @staticmethod
+    def chunk_text(text: str, chunk_chars: int) -> List[str]:
+        chunks = []
+        while len(text) > chunk_chars:
+            # Prefer to cut on a line break so chunks don't split sentences mid-way
+            cut = text.rfind("\n", 0, chunk_chars)
+            if cut <= chunk_chars // 2:
+                cut = chunk_chars
+            chunks.append(text[:cut])
+            text = text[cut:].lstrip("\n")
+        if text.strip():
+            chunks.append(text)
+        return chunks
+
+    @staticmethod
+    def _count_lines(file_path: str) -> int:
+        if os.path.getsize(file_path) == 0:
+            return 0
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            count, pos = 0, mm.find(b"\n")
+            while pos != -1:
+                count += 1
+                pos = mm.find(b"\n", pos + 1)
+            if mm[-1:] != b"\n":
+                count += 1
+            return count
+
+    @classmethod
+    def stat(cls, file_path: str) -> Dict[str, Any]:
+        """Cheap size information for a document without extracting its text."""
+        ext = os.path.splitext(file_path)[1].lower()
+        info: Dict[str, Any] = {"path": file_path, "extension": ext, "size_bytes": os.path.getsize(file_path)}
+        try:
+            if ext in TEXT_EXTENSIONS:
+                info["lines"] = cls._count_lines(file_path)
+            elif ext == '.pdf':
+                with open(file_path, 'rb') as f:
+                    info["pages"] = len(pypdf.PdfReader(f).pages)
+            elif ext == '.csv':
+                info["rows"] = max(cls._count_lines(file_path) - 1, 0)
+            elif ext == '.xlsx':
+                from openpyxl import load_workbook
+                wb = load_workbook(file_path, read_only=True)
+                info["rows"] = max((wb.active.max_row or 1) - 1, 0)
+                wb.close()
+            elif ext == '.docx':
+                info["paragraphs"] = len(Document(file_path).paragraphs)
+        except Exception as e:
+            info["error"] = str(e)
+        return info
+
+    @classmethod
+    def line_char_offset(cls, file_path: str, line: int, **ranges) -> Optional[int]:
+        """Char offset where a line starts, for switching a read from unit="lines" to unit="chars"."""
+        if os.path.splitext(file_path)[1].lower() not in TEXT_EXTENSIONS:
+            result = cls.read_range(file_path, unit="chars", **ranges)
+            return cls._line_end(result[0], line) if result else None
+        # Count in blocks, reading the file the same way read_text_range does for chars
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+            chars, remaining = 0, line
+            while remaining > 0:
+                block = f.read(1 << 20)
+                if not block:
+                    return None
+                pos = 0
+                while remaining > 0:
+                    pos = block.find("\n", pos) + 1
+                    if pos == 0:
+                        break
+                    remaining -= 1
+                if remaining == 0:
+                    return chars + pos
+                chars += len(block)
+            return chars
+
+    @staticmethod
+    def _line_end(text: str, lines: int) -> Optional[int]:
+        # Index just past the given number of newline-terminated lines, or None if the text is shorter
+        pos = 0
+        for _ in range(lines):
+            pos = text.find("\n", pos) + 1
+            if pos == 0:
+                return None
+        return pos
+
+    @classmethod
+    def _slice(cls, text: str, offset: int, limit: Optional[int], unit: str) -> Tuple[str, Optional[int]]:
+        """Slice in-memory text, returning the slice and the offset to continue from (None at the end)."""
+        if unit == "bytes":
+            data = text.encode('utf-8')
+            end = offset + limit if limit is not None else len(data)
+            return data[offset:end].decode('utf-8', errors='ignore'), end if end < len(data) else None
+        if unit == "lines":
+            start = cls._line_end(text, offset)
+            if start is None:
+                return "", None
+            rest = text[start:]
+            end = cls._line_end(rest, limit) if limit is not None else None
+            if end is None or end >= len(rest):
+                return rest, None
+            return rest[:end], offset + limit
+        end = offset + limit if limit is not None else len(text)
+        return text[offset:end], end if end < len(text) else None
+
+    @classmethod
+    def read_range(
+        cls,
+        file_path: str,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        unit: str = "chars",
+        start_page: Optional[int] = None,
+        end_page: Optional[int] = None,
+        start_row: Optional[int] = None,
+        end_row: Optional[int] = None,
+    ) -> Optional[Tuple[str, Optional[int]]]:
+        """Read part of a document: a text slice, a PDF page range or a spreadsheet row range.
+
+        offset/limit apply within the selected pages or rows. Returns the content and the offset
+        to continue from, or None as the offset once the end is reached.
+        """
+        ext = os.path.splitext(file_path)[1].lower()
+        try:
+            if ext in TEXT_EXTENSIONS:
+                if unit == "bytes":
+                    content = cls.read_text_range(file_path, offset, limit, unit)
+                    end = offset + limit if limit is not None else None
+                    return content, end if end is not None and end < os.path.getsize(file_path) else None
+                # Read one unit past the limit so we can tell whether more follows
+                content = cls.read_text_range(file_path, offset, limit + 1 if limit is not None else None, unit)
+                content, more = cls._slice(content, 0, limit, unit)
+                return content, offset + limit if more is not None else None
+            if ext == '.pdf' and (start_page or end_page):
+                return cls._slice(cls.parse_pdf(file_path, start_page, end_page), offset, limit, unit)
+            if ext in SPREADSHEET_EXTENSIONS and (start_row is not None or end_row is not None):
+                return cls._slice(cls.parse_spreadsheet(file_path, start_row, end_row), offset, limit, unit)
+        except Exception as e:
+            print(f"Error reading {file_path}: {e}")
+            record_parse_failure(file_path)
+            return None
+        # Other formats have to be extracted in full before slicing
+        content = cls.parse(file_path)
+        if content is None:
+            return None
+        return cls._slice(content, offset, limit, unit)
+
     @classmethod
     def parse(cls, file_path: str) -> Optional[str]:
         ext = os.path.splitext(file_path)[1].lower()
@@ -63,4 +259,5 @@ class DocumentParser:
                 return None
         except Exception as e:
             print(f"Error parsing {file_path}: {e}")
+            record_parse_failure(file_path)
             return None
@@ -1,19 +1,220 @@
+import hashlib
+import json
 import os
+import threading
+import time
 import chromadb
 from chromadb.utils import embedding_functions
 from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from .parsers import DocumentParser
+from .vector_store import MmapVectorClient
+from .metrics import timed, INDEX_FILES_PER_SECOND, INDEXED_FILES, DEDUPLICATED_FILES, DEDUPLICATED_CHUNKS
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+REGISTRY_FILE = "partitions.json"
+LEGACY_COLLECTION = "client_data"
+MIGRATION_LOCK_FILE = "migration.lock"
+# How often a Chroma server's partition list is re-read to pick up partitions made by other nodes
+REGISTRY_REFRESH_SECONDS = 5.0
+CHUNK_CHARS = 2000
+ADD_BATCH_SIZE = 256
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def file_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def result_sources(result: Dict[str, Any]) -> List[str]:
+    """Every file path holding a result's content, oldest first."""
+    # Query results carry the list merged across partitions; stored metadata only knows its own
+    if result.get("sources"):
+        return result["sources"]
+    metadata = result["metadata"]
+    if metadata.get("sources"):
+        return json.loads(metadata["sources"])
+    return [metadata["source"]]
 
 class RAGEngine:
-    def __init__(self, persist_directory: str = "./chroma_db"):
+    def __init__(self, persist_directory: Optional[str] = None):
+        # VECTOR_STORE=mmap swaps Chroma for the memory-mapped quantized store in vector_store.py
+        backend = os.getenv("VECTOR_STORE", "chroma").lower()
+        if backend == "mmap":
+            persist_directory = persist_directory or os.getenv("VECTOR_DB_PATH", "./vector_db")
+            self.client = MmapVectorClient(persist_directory, dtype=os.getenv("VECTOR_DTYPE", "int8"))
+        elif os.getenv("CHROMA_HOST"):
+            # A Chroma server lets several API workers and nodes share one store. The partition registry
+            # then lives on the server too, as collection metadata. The local stores (chroma_db, mmap)
+            # rely on flock and must only be shared by workers on one machine, not over NFS
+            persist_directory = persist_directory or "./chroma_db"
+            os.makedirs(persist_directory, exist_ok=True)
+            self.client = chromadb.HttpClient(host=os.getenv("CHROMA_HOST"), port=int(os.getenv("CHROMA_PORT", "8000")))
+        else:
+            persist_directory = persist_directory or "./chroma_db"
+            self.client = chromadb.PersistentClient(path=persist_directory)
         self.persist_directory = persist_directory
-        self.client = chromadb.PersistentClient(path=persist_directory)
         self.embedding_fn = embedding_functions.SentenceTransformerEmbeddingFunction(model_name="all-MiniLM-L6-v2")
-        self.collection = self.client.get_or_create_collection(
-            name="client_data", 
-            embedding_function=self.embedding_fn
-        )
+        # Each indexed root gets its own collection; the registry maps root -> collection name
+        self.registry_path = os.path.join(persist_directory, REGISTRY_FILE)
+        self.registry_lock = threading.Lock()
+        self.registry_mtime = None
+        self.shared_registry = backend != "mmap" and bool(os.getenv("CHROMA_HOST"))
+        if self.shared_registry:
+            self._tag_file_partitions()
+        self.registry = self._load_registry()
+        self._migrate_legacy_collection()
+
+    def _tag_file_partitions(self):
+        # Partitions created on a Chroma server before the registry moved there are only listed in the local file
+        if not os.path.exists(self.registry_path):
+            return
+        with open(self.registry_path, 'r') as f:
+            for directory, name in json.load(f).items():
+                try:
+                    self.client.get_collection(name=name).modify(metadata={"directory": directory})
+                except Exception:
+                    continue
+
+    def _load_registry(self) -> Dict[str, str]:
+        if self.shared_registry:
+            self.registry_loaded = time.monotonic()
+            registry = {}
+            for entry in self.client.list_collections():
+                # Chroma >= 0.6 returns names, older versions return Collection objects
+                collection = self.client.get_collection(name=entry) if isinstance(entry, str) else entry
+                directory = (collection.metadata or {}).get("directory")
+                if collection.name.startswith("dir_") and directory:
+                    registry[directory] = collection.name
+            return registry
+        if os.path.exists(self.registry_path):
+            self.registry_mtime = os.path.getmtime(self.registry_path)
+            with open(self.registry_path, 'r') as f:
+                return json.load(f)
+        return {}
+
+    def _refresh_registry(self, force: bool = False):
+        if self.shared_registry:
+            if force or time.monotonic() - self.registry_loaded > REGISTRY_REFRESH_SECONDS:
+                self.registry = self._load_registry()
+            return
+        # Other workers may have added or dropped partitions; reload when the file changes
+        if os.path.exists(self.registry_path) and os.path.getmtime(self.registry_path) != self.registry_mtime:
+            self.registry = self._load_registry()
+
+    def _save_registry(self):
+        if self.shared_registry:
+            # Creating or deleting the collection is what updates the shared registry
+            return
+        tmp_path = self.registry_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.registry, f, indent=2)
+        os.replace(tmp_path, self.registry_path)
+        self.registry_mtime = os.path.getmtime(self.registry_path)
+
+    @staticmethod
+    def partition_name(abs_directory: str) -> str:
+        # Chroma names are limited to 63 safe characters, so derive one from the path
+        return "dir_" + hashlib.sha1(abs_directory.encode('utf-8')).hexdigest()[:24]
+
+    def _collection_for(self, directory_path: str, create: bool = False):
+        abs_directory = os.path.abspath(directory_path)
+        with self.registry_lock:
+            self._refresh_registry()
+            name = self.registry.get(abs_directory)
+            if name is None and self.shared_registry:
+                # Another node may have created it since the last refresh
+                self._refresh_registry(force=True)
+                name = self.registry.get(abs_directory)
+            if name is None:
+                if not create:
+                    return None
+                name = self.partition_name(abs_directory)
+                self.registry[abs_directory] = name
+                self._save_registry()
+                if self.shared_registry:
+                    return self.client.get_or_create_collection(name=name, embedding_function=self.embedding_fn, metadata={"directory": abs_directory})
+        return self.client.get_or_create_collection(name=name, embedding_function=self.embedding_fn)
+
+    def _partitions(self) -> list:
+        with self.registry_lock:
+            self._refresh_registry()
+            names = list(self.registry.values())
+        if not self.shared_registry:
+            return [self.client.get_or_create_collection(name=name, embedding_function=self.embedding_fn) for name in names]
+        # Don't recreate, without its metadata, a partition another node dropped since the last refresh
+        partitions = []
+        for name in names:
+            try:
+                partitions.append(self.client.get_collection(name=name, embedding_function=self.embedding_fn))
+            except Exception:
+                continue
+        return partitions
+
+    def _migrate_legacy_collection(self, batch_size: int = 500):
+        """Move documents from the old single client_data collection into per-directory partitions."""
+        try:
+            self.client.get_collection(name=LEGACY_COLLECTION)
+        except Exception:
+            return
+        # Every worker runs this at startup; hold a file lock so only one migrates and the rest wait for it.
+        # The lock only covers this machine, so with a Chroma server let one node finish starting first
+        with open(os.path.join(self.persist_directory, MIGRATION_LOCK_FILE), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                legacy = self.client.get_collection(name=LEGACY_COLLECTION)
+            except Exception:
+                # Another worker finished the migration while we waited
+                self._refresh_registry()
+                return
+            self._migrate_batches(legacy, batch_size)
+
+    def _migrate_batches(self, legacy, batch_size: int):
+        while True:
+            batch = legacy.get(limit=batch_size, include=["documents", "metadatas", "embeddings"])
+            if not batch['ids']:
+                break
+            by_directory: Dict[str, Dict[str, list]] = {}
+            for i, doc_id in enumerate(batch['ids']):
+                directory = batch['metadatas'][i].get("directory") or os.path.dirname(doc_id)
+                group = by_directory.setdefault(directory, {"ids": [], "documents": [], "metadatas": [], "embeddings": []})
+                group["ids"].append(doc_id)
+                group["documents"].append(batch['documents'][i])
+                group["metadatas"].append(batch['metadatas'][i])
+                group["embeddings"].append(batch['embeddings'][i])
+            for directory, group in by_directory.items():
+                self._collection_for(directory, create=True).upsert(**group)
+            legacy.delete(ids=batch['ids'])
+        try:
+            self.client.delete_collection(name=LEGACY_COLLECTION)
+        except Exception:
+            pass
+        print(f"Migrated {LEGACY_COLLECTION} into {len(self.registry)} directory partitions")
+
+    def indexed_directories(self) -> List[str]:
+        with self.registry_lock:
+            self._refresh_registry()
+            return list(self.registry.keys())
+
+    def drop_directory(self, directory_path: str) -> bool:
+        abs_directory = os.path.abspath(directory_path)
+        with self.registry_lock:
+            self._refresh_registry()
+            name = self.registry.pop(abs_directory, None)
+            if name is None:
+                return False
+            self._save_registry()
+        self.client.delete_collection(name=name)
+        return True
 
     def index_directory(self, directory_path: str):
         # Ensure we use absolute path for consistency
@@ -22,6 +223,14 @@ class RAGEngine:
         # Exclude directories that are typically massive or irrelevant
         exclude_dirs = {'.git', 'node_modules', '__pycache__', 'Library', 'Temp', 'Logs'}
         
+        collection = self._collection_for(abs_directory, create=True)
+        start = time.perf_counter()
+        indexed = 0
+        # Identical files are parsed once per run, identical chunks embedded once per partition.
+        # Chunk ids are content hashes; each chunk lists every path it was found in.
+        seen_files: Dict[str, List[str]] = {}
+        pending: Dict[str, Dict[str, Any]] = {}
+        produced: Dict[str, set] = {}
         for root, dirs, files in os.walk(abs_directory):
             # Remove excluded directories from search
             dirs[:] = [d for d in dirs if d not in exclude_dirs]
@@ -31,37 +240,179 @@ class RAGEngine:
                 # Skip binary files that are too large or known images if tesseract is missing
                 if file.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.pdf', '.exe', '.dll', '.so')):
                     continue
-                    
-                content = DocumentParser.parse(file_path)
-                if content:
-                    self.collection.add(
-                        documents=[content],
-                        metadatas=[{"source": file_path, "filename": file, "directory": abs_directory}],
-                        ids=[file_path]
-                    )
-        print(f"Indexed directory: {abs_directory}")
+                
+                try:
+                    digest = file_hash(file_path)
+                except OSError:
+                    continue
+                
+                chunk_ids = seen_files.get(digest)
+                if chunk_ids is not None:
+                    DEDUPLICATED_FILES.inc()
+                else:
+                    with timed("index_parse"):
+                        content = DocumentParser.parse(file_path)
+                    if not content:
+                        continue
+                    chunk_ids = []
+                    for chunk in DocumentParser.chunk_text(content, CHUNK_CHARS):
+                        chunk_id = content_hash(chunk.encode('utf-8'))
+                        chunk_ids.append(chunk_id)
+                        if chunk_id not in pending:
+                            pending[chunk_id] = {
+                                "document": chunk,
+                                "metadata": {"source": file_path, "filename": file, "directory": abs_directory, "content_hash": chunk_id},
+                                "sources": [],
+                            }
+                    seen_files[digest] = chunk_ids
+                
+                produced[file_path] = set(chunk_ids)
+                for chunk_id in chunk_ids:
+                    entry = pending.setdefault(chunk_id, {"document": None, "metadata": None, "sources": []})
+                    if file_path not in entry["sources"]:
+                        entry["sources"].append(file_path)
+                indexed += 1
+                INDEXED_FILES.inc()
+                
+                if len(pending) >= ADD_BATCH_SIZE:
+                    self._flush_chunks(collection, pending)
+                    pending = {}
+        
+        if pending:
+            self._flush_chunks(collection, pending)
+        self._prune_stale(collection, produced)
+        
+        elapsed = time.perf_counter() - start
+        if elapsed > 0:
+            INDEX_FILES_PER_SECOND.set(indexed / elapsed)
+        print(f"Indexed directory: {abs_directory} ({indexed} files in {elapsed:.1f}s)")
+
+    def _flush_chunks(self, collection, pending: Dict[str, Dict[str, Any]]):
+        ids = list(pending.keys())
+        existing = collection.get(ids=ids, include=["metadatas"])
+        existing_meta = dict(zip(existing['ids'], existing['metadatas']))
+        
+        update_ids, update_metas = [], []
+        new_ids, new_docs, new_metas = [], [], []
+        for chunk_id, entry in pending.items():
+            if chunk_id in existing_meta:
+                DEDUPLICATED_CHUNKS.inc()
+                meta = dict(existing_meta[chunk_id])
+                sources = result_sources({"metadata": meta})
+                added = [p for p in entry["sources"] if p not in sources]
+                if added:
+                    meta["sources"] = json.dumps(sources + added)
+                    update_ids.append(chunk_id)
+                    update_metas.append(meta)
+            elif entry["document"] is not None:
+                meta = dict(entry["metadata"], sources=json.dumps(entry["sources"]))
+                new_ids.append(chunk_id)
+                new_docs.append(entry["document"])
+                new_metas.append(meta)
+        
+        if update_ids:
+            collection.update(ids=update_ids, metadatas=update_metas)
+        if new_ids:
+            with timed("index_add"):
+                collection.add(ids=new_ids, documents=new_docs, metadatas=new_metas)
+
+    def _prune_stale(self, collection, produced: Dict[str, set], batch_size: int = 1000):
+        """Drop paths from chunks their file no longer produces, and chunks left with no paths.
+
+        A run walks the whole root, so any path not seen this time was edited, deleted or became
+        unparseable. Whole-file entries from before chunking (id == source path) are removed too.
+        """
+        delete_ids, update_ids, update_metas = [], [], []
+        offset = 0
+        while True:
+            batch = collection.get(limit=batch_size, offset=offset, include=["metadatas"])
+            if not batch['ids']:
+                break
+            offset += len(batch['ids'])
+            for chunk_id, meta in zip(batch['ids'], batch['metadatas']):
+                if not meta.get("content_hash"):
+                    delete_ids.append(chunk_id)
+                    continue
+                sources = result_sources({"metadata": meta})
+                keep = [p for p in sources if chunk_id in produced.get(p, ())]
+                if not keep:
+                    delete_ids.append(chunk_id)
+                elif keep != sources:
+                    update_ids.append(chunk_id)
+                    update_metas.append(dict(meta, sources=json.dumps(keep), source=keep[0], filename=os.path.basename(keep[0])))
+        
+        for start in range(0, len(delete_ids), batch_size):
+            collection.delete(ids=delete_ids[start:start + batch_size])
+        for start in range(0, len(update_ids), batch_size):
+            collection.update(ids=update_ids[start:start + batch_size], metadatas=update_metas[start:start + batch_size])
 
     def query(self, text: str, n_results: int = 5, directory_path: str = None) -> List[Dict[str, Any]]:
-        query_params = {
-            "query_texts": [text],
-            "n_results": n_results
-        }
+        return self.query_batch([text], n_results=n_results, directory_path=directory_path)[0]
+
+    def query_batch(self, texts: List[str], n_results: int = 5, directory_path: str = None) -> List[List[Dict[str, Any]]]:
+        # Embed explicitly so embedding and vector search are timed separately,
+        # and so many queries share one embedding pass and one collection lookup
+        with timed("embed"):
+            query_embeddings = self.embedding_fn(texts)
         
+        # Scoped queries hit only their partition; unscoped ones fan out and merge by distance
         if directory_path:
-            abs_directory = os.path.abspath(directory_path)
-            query_params["where"] = {"directory": abs_directory}
-            
-        results = self.collection.query(**query_params)
+            collection = self._collection_for(directory_path)
+            collections = [collection] if collection is not None else []
+        else:
+            collections = self._partitions()
+        
+        batch_results = [[] for _ in texts]
+        with timed("vector_search"):
+            for collection in collections:
+                count = collection.count()
+                if count == 0:
+                    continue
+                results = collection.query(query_embeddings=query_embeddings, n_results=min(n_results, count))
+                for q in range(len(texts)):
+                    for i in range(len(results['documents'][q])):
+                        batch_results[q].append({
+                            "content": results['documents'][q][i],
+                            "metadata": results['metadatas'][q][i],
+                            "distance": results['distances'][q][i] if results.get('distances') else None
+                        })
         
-        formatted_results = []
-        if results['documents']:
-            for i in range(len(results['documents'][0])):
-                formatted_results.append({
-                    "content": results['documents'][0][i],
-                    "metadata": results['metadatas'][0][i],
-                    "distance": results['distances'][0][i] if 'distances' in results else None
-                })
-        return formatted_results
-
-    def get_all_documents(self):
-        return self.collection.get()
+        return [self._collapse(results, n_results) for results in batch_results]
+
+    @staticmethod
+    def _collapse(results: List[Dict[str, Any]], n_results: int) -> List[Dict[str, Any]]:
+        # Merge hits with identical content (e.g. the same file indexed under two roots)
+        results = sorted(results, key=lambda res: res["distance"] if res["distance"] is not None else float("inf"))
+        collapsed: Dict[str, Dict[str, Any]] = {}
+        for res in results:
+            key = res["metadata"].get("content_hash") or content_hash(res["content"].encode('utf-8'))
+            sources = result_sources(res)
+            if key in collapsed:
+                merged = collapsed[key]["sources"]
+                merged.extend(p for p in sources if p not in merged)
+            else:
+                collapsed[key] = dict(res, sources=sources)
+        return list(collapsed.values())[:n_results]
+
+    def get_directory_documents(self, directory_path: str) -> List[Dict[str, Any]]:
+        collection = self._collection_for(directory_path)
+        if collection is None:
+            return []
+        results = collection.get()
+        return [
+            {"content": doc, "metadata": meta}
+            for doc, meta in zip(results['documents'], results['metadatas'])
+        ]
+
+    def get_all_documents(self, directory_path: Optional[str] = None):
+        if directory_path:
+            collection = self._collection_for(directory_path)
+            collections = [collection] if collection is not None else []
+        else:
+            collections = self._partitions()
+        merged = {"ids": [], "documents": [], "metadatas": []}
+        for collection in collections:
+            results = collection.get()
+            for key in merged:
+                merged[key].extend(results[key] or [])
+        return merged
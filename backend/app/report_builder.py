@@ -0,0 +1,105 @@
+import asyncio
+import hashlib
+import os
+import time
+from typing import Dict, List, Optional
+from .chat_engine import ChatEngine
+from .chat_storage import connect, state_db_path
+from .llm_scheduler import BATCH
+from .parsers import DocumentParser
+from .metrics import timed
+
+MAP_PROMPT = "Summarize this document excerpt for use in a professional report. Keep key facts, figures, names and conclusions."
+REDUCE_PROMPT = "Merge these partial summaries into one concise summary. Remove repetition but keep every distinct fact and figure."
+REPORT_PROMPT = "Write a professional report from these document summaries."
+# Cached summaries unused for this long, or beyond this many rows, are dropped on write
+SUMMARY_CACHE_MAX_AGE = float(os.getenv("SUMMARY_CACHE_DAYS", "30")) * 86400
+SUMMARY_CACHE_MAX_ROWS = int(os.getenv("SUMMARY_CACHE_ROWS", "20000"))
+
+class ReportBuilder:
+    """Map-reduce report generation: summarize chunks concurrently, then merge hierarchically."""
+
+    def __init__(self, chat_engine: ChatEngine, storage_path: Optional[str] = None, max_concurrency: int = 4, chunk_chars: int = 6000, queue_timeout: float = 120.0):
+        self.chat_engine = chat_engine
+        self.max_concurrency = max_concurrency
+        self.chunk_chars = chunk_chars
+        # Export calls queue behind interactive queries, so they get a longer deadline
+        self.queue_timeout = queue_timeout
+        # Summaries are cached in the shared state database so every worker benefits
+        self.db_path = state_db_path(storage_path)
+        with connect(self.db_path) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS summary_cache (key TEXT PRIMARY KEY, summary TEXT NOT NULL, used_at REAL NOT NULL DEFAULT 0)")
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(summary_cache)")]
+            if "used_at" not in columns:
+                conn.execute("ALTER TABLE summary_cache ADD COLUMN used_at REAL NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS summary_cache_used_at ON summary_cache (used_at)")
+
+    def _cached(self, key: str):
+        with connect(self.db_path) as conn:
+            row = conn.execute("SELECT summary FROM summary_cache WHERE key = ?", (key,)).fetchone()
+            if row:
+                conn.execute("UPDATE summary_cache SET used_at = ? WHERE key = ?", (time.time(), key))
+        return row[0] if row else None
+
+    def _store(self, key: str, summary: str):
+        now = time.time()
+        with connect(self.db_path) as conn:
+            conn.execute("INSERT OR REPLACE INTO summary_cache (key, summary, used_at) VALUES (?, ?, ?)", (key, summary, now))
+            # Old chunk versions and intermediate reduce levels are never asked for again
+            conn.execute("DELETE FROM summary_cache WHERE used_at < ?", (now - SUMMARY_CACHE_MAX_AGE,))
+            conn.execute(
+                "DELETE FROM summary_cache WHERE key IN (SELECT key FROM summary_cache ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (SUMMARY_CACHE_MAX_ROWS,)
+            )
+
+    async def _summarize(self, semaphore: asyncio.Semaphore, instruction: str, text: str) -> str:
+        key = hashlib.sha256(f"{instruction}\0{text}".encode('utf-8')).hexdigest()
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+        async with semaphore:
+            summary = await self.chat_engine.generate_response(instruction, text, raise_errors=True, priority=BATCH, timeout=self.queue_timeout)
+        self._store(key, summary)
+        return summary
+
+    def _group(self, summaries: List[str]) -> List[str]:
+        # Pack summaries into groups that fit in one prompt, at least two per group so each level shrinks
+        groups, current, size = [], [], 0
+        for summary in summaries:
+            if len(current) >= 2 and size + len(summary) > self.chunk_chars:
+                groups.append("\n\n---\n\n".join(current))
+                current, size = [], 0
+            current.append(summary)
+            size += len(summary)
+        if current:
+            groups.append("\n\n---\n\n".join(current))
+        return groups
+
+    @staticmethod
+    async def _gather(coros) -> List[str]:
+        # Cancel the remaining summaries as soon as one fails, so a failed export stops calling the provider
+        tasks = [asyncio.ensure_future(c) for c in coros]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def build(self, documents: List[Dict], focus: str = "") -> str:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        with timed("export_map"):
+            chunks = []
+            for doc in documents:
+                source = doc['metadata']['source']
+                chunks.extend(f"Source: {source}\n{chunk}" for chunk in DocumentParser.chunk_text(doc['content'], self.chunk_chars))
+            summaries = await self._gather([self._summarize(semaphore, MAP_PROMPT, c) for c in chunks])
+
+        with timed("export_reduce"):
+            while len(summaries) > 1 and sum(len(s) for s in summaries) > self.chunk_chars:
+                groups = self._group(summaries)
+                summaries = await self._gather([self._summarize(semaphore, REDUCE_PROMPT, g) for g in groups])
+
+        instruction = f"{REPORT_PROMPT} Focus: {focus}" if focus else REPORT_PROMPT
+        return await self.chat_engine.generate_response(instruction, "\n\n---\n\n".join(summaries), raise_errors=True, priority=BATCH, timeout=self.queue_timeout)
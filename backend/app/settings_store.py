@@ -0,0 +1,45 @@
+import json
+import os
+from typing import Dict, Optional
+from .chat_storage import connect, restrict_to_owner, state_db_path
+
+API_KEY_FIELDS = ("openai_key", "openrouter_key", "gemini_key", "groq_key")
+# API keys are shared through the state database (created 0600) so every worker can use them.
+# With PERSIST_API_KEYS=0 they are never written; other workers keep the keys from their environment
+PERSIST_API_KEYS = os.getenv("PERSIST_API_KEYS", "1").lower() in ("1", "true", "yes")
+
+class SettingsStore:
+    """Provider settings shared by all API workers through the state database.
+
+    Every save bumps a version number; workers call poll() to pick up changes made by any worker.
+    """
+
+    def __init__(self, storage_path: Optional[str] = None):
+        self.db_path = state_db_path(storage_path)
+        self.version = 0
+        # Databases created before keys were stored here may still be world-readable
+        if PERSIST_API_KEYS:
+            restrict_to_owner(self.db_path)
+        with connect(self.db_path) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS settings (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL, data TEXT NOT NULL)")
+
+    def save(self, settings: Dict):
+        """Store settings for the other workers. The caller applies them to its own worker directly."""
+        if not PERSIST_API_KEYS:
+            settings = {k: v for k, v in settings.items() if k not in API_KEY_FIELDS}
+        with connect(self.db_path) as conn:
+            conn.execute(
+                "INSERT INTO settings (id, version, data) VALUES (1, 1, ?) "
+                "ON CONFLICT(id) DO UPDATE SET version = version + 1, data = excluded.data",
+                (json.dumps(settings),)
+            )
+            self.version = conn.execute("SELECT version FROM settings WHERE id = 1").fetchone()[0]
+
+    def poll(self) -> Optional[Dict]:
+        """Return the stored settings if they changed since the last poll, else None."""
+        with connect(self.db_path) as conn:
+            row = conn.execute("SELECT version, data FROM settings WHERE id = 1").fetchone()
+        if row is None or row[0] == self.version:
+            return None
+        self.version = row[0]
+        return json.loads(row[1])
@@ -0,0 +1,494 @@
+"""Memory-mapped, quantized vector store usable in place of Chroma's PersistentClient.
+
+Each collection is a directory holding:
+  vectors.npy    (capacity, dim) int8 or float16 embeddings, L2-normalized before quantization
+  scales.npy     (capacity,) float32 per-row dequantization scale (1.0 for float16)
+  lists.npy      (capacity,) int32 IVF list of each row, -1 before the index is trained, -2 once deleted
+  centroids.npy  (nlist, dim) float32 IVF centroids
+  meta.sqlite    ids, documents and metadata keyed by row number
+
+The arrays are opened with mmap, so startup only reads headers and memory comes from the page cache.
+Only the subset of the Chroma collection API that RAGEngine uses is implemented.
+
+Several API workers on one machine can share a store: every call holds a flock on the collection's
+lock file (shared for reads, exclusive for writes), and each write bumps a generation number in
+meta.sqlite that tells the other processes to reload their row counts and re-open the arrays.
+flock and SQLite are unreliable over NFS, so a store must not be shared between nodes. Without fcntl
+(Windows) there is no cross-process lock, so run a single worker there.
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MIN_CAPACITY = 1024
+# Below this many rows a brute-force scan is fast enough and needs no training
+IVF_TRAIN_THRESHOLD = 10000
+SCORE_BLOCK_ROWS = 65536
+UNASSIGNED = -1
+DELETED = -2
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+class MmapCollection:
+    def __init__(self, path: str, name: str, embedding_function=None, dtype: str = "int8"):
+        self.path = path
+        self.name = name
+        self.embedding_function = embedding_function
+        self.lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(path, "meta.sqlite"), check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS rows (idx INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, document TEXT, metadata TEXT NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.db.commit()
+        self.default_dtype = dtype
+        self._lock_file = open(self._file("lock"), "a+")
+        self._depth = 0
+        self._generation = None
+        with self._locked():
+            pass
+
+    @contextmanager
+    def _locked(self, exclusive: bool = False):
+        # The RLock covers threads in this process, the flock other worker processes
+        with self.lock:
+            outer = self._depth == 0
+            if outer and fcntl is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self._depth += 1
+            try:
+                if outer:
+                    self._sync()
+                yield
+            finally:
+                self._depth -= 1
+                if outer and fcntl is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _sync(self):
+        """Reload state if another process wrote to the collection since we last looked."""
+        row = self.db.execute("SELECT value FROM info WHERE key = 'generation'").fetchone()
+        generation = int(row[0]) if row else 0
+        if generation == self._generation:
+            return
+        info = dict(self.db.execute("SELECT key, value FROM info").fetchall())
+        self.dtype = info.get("dtype", self.default_dtype)
+        self.dim = int(info["dim"]) if "dim" in info else None
+        self.trained_on = int(info.get("trained_on", 0))
+        # _count is the number of live rows, _next the first unused row (deleted rows leave gaps)
+        self._count = self.db.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+        self._next = self.db.execute("SELECT COALESCE(MAX(idx) + 1, 0) FROM rows").fetchone()[0]
+        # The arrays may have been grown into new files, so map them again
+        self._vectors = None
+        self._scales = None
+        self._lists = None
+        self._centroids = None
+        self._ivf = None
+        self._generation = generation
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _set_info(self, key: str, value: Any):
+        self.db.execute("INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _open_arrays(self):
+        if self._vectors is None and os.path.exists(self._file("vectors.npy")):
+            self._vectors = np.load(self._file("vectors.npy"), mmap_mode="r+")
+            self._scales = np.load(self._file("scales.npy"), mmap_mode="r+")
+            self._lists = np.load(self._file("lists.npy"), mmap_mode="r+")
+            if os.path.exists(self._file("centroids.npy")):
+                self._centroids = np.load(self._file("centroids.npy"))
+
+    def _ensure_capacity(self, needed: int):
+        self._open_arrays()
+        capacity = self._vectors.shape[0] if self._vectors is not None else 0
+        if needed <= capacity:
+            return
+        new_capacity = max(MIN_CAPACITY, capacity * 2, needed)
+        arrays = {
+            "vectors.npy": ((new_capacity, self.dim), np.dtype(self.dtype), self._vectors),
+            "scales.npy": ((new_capacity,), np.dtype(np.float32), self._scales),
+            "lists.npy": ((new_capacity,), np.dtype(np.int32), self._lists),
+        }
+        grown = {}
+        for filename, (shape, dtype, old) in arrays.items():
+            tmp = self._file(filename + ".tmp")
+            new = np.lib.format.open_memmap(tmp, mode="w+", dtype=dtype, shape=shape)
+            if filename == "lists.npy":
+                new[:] = UNASSIGNED
+            if old is not None:
+                new[:self._next] = old[:self._next]
+            new.flush()
+            del new
+            grown[filename] = tmp
+        self._vectors = self._scales = self._lists = None
+        for filename, tmp in grown.items():
+            os.replace(tmp, self._file(filename))
+        self._open_arrays()
+
+    def _quantize(self, vectors: np.ndarray):
+        if self.dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+            return quantized, scales.astype(np.float32)
+        return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+
+    def _dequantize(self, rows: np.ndarray) -> np.ndarray:
+        return self._vectors[rows].astype(np.float32) * self._scales[rows, None]
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        if self._centroids is None:
+            return np.full(len(vectors), UNASSIGNED, dtype=np.int32)
+        return np.argmax(vectors @ self._centroids.T, axis=1).astype(np.int32)
+
+    def _embed(self, documents: List[str]) -> np.ndarray:
+        if self.embedding_function is None:
+            raise ValueError(f"Collection {self.name} has no embedding function; pass embeddings explicitly")
+        return np.asarray(self.embedding_function(documents), dtype=np.float32)
+
+    def _write_vectors(self, rows: np.ndarray, vectors: np.ndarray):
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self._set_info("dim", self.dim)
+            self._set_info("dtype", self.dtype)
+        self._ensure_capacity(int(rows.max()) + 1)
+        quantized, scales = self._quantize(vectors)
+        self._vectors[rows] = quantized
+        self._scales[rows] = scales
+        self._lists[rows] = self._assign(vectors)
+        self._ivf = None
+
+    def _flush(self):
+        self._generation = (self._generation or 0) + 1
+        self._set_info("generation", self._generation)
+        self.db.commit()
+        for array in (self._vectors, self._scales, self._lists):
+            if array is not None:
+                array.flush()
+
+    def _existing(self, ids: List[str]) -> Dict[str, int]:
+        found = {}
+        for start in range(0, len(ids), 500):
+            part = ids[start:start + 500]
+            placeholders = ",".join("?" * len(part))
+            found.update(self.db.execute(f"SELECT id, idx FROM rows WHERE id IN ({placeholders})", part).fetchall())
+        return found
+
+    def count(self) -> int:
+        with self._locked():
+            return self._count
+
+    def add(self, ids: List[str], documents: Optional[List[str]] = None, metadatas: Optional[List[Dict]] = None, embeddings=None):
+        with self._locked(exclusive=True):
+            existing = self._existing(ids)
+            # Like Chroma, adding an id that already exists is a no-op
+            keep = [i for i, doc_id in enumerate(ids) if doc_id not in existing]
+            if not keep:
+                return
+            documents = documents or [None] * len(ids)
+            metadatas = metadatas or [{}] * len(ids)
+            if embeddings is None:
+                vectors = self._embed([documents[i] for i in keep])
+            else:
+                vectors = np.asarray(embeddings, dtype=np.float32)[keep]
+            rows = np.arange(self._next, self._next + len(keep))
+            self._write_vectors(rows, vectors)
+            self.db.executemany(
+                "INSERT INTO rows (idx, id, document, metadata) VALUES (?, ?, ?, ?)",
+                [(int(row), ids[i], documents[i], json.dumps(metadatas[i] or {})) for row, i in zip(rows, keep)],
+            )
+            self._count += len(keep)
+            self._next += len(keep)
+            self._flush()
+            if self._count >= IVF_TRAIN_THRESHOLD and self._count >= 4 * max(self.trained_on, 1):
+                self.build_index()
+
+    def update(self, ids: List[str], documents: Optional[List[str]] = None, metadatas: Optional[List[Dict]] = None, embeddings=None):
+        with self._locked(exclusive=True):
+            existing = self._existing(ids)
+            positions = [i for i, doc_id in enumerate(ids) if doc_id in existing]
+            if not positions:
+                return
+            rows = np.array([existing[ids[i]] for i in positions])
+            if embeddings is not None:
+                self._write_vectors(rows, np.asarray(embeddings, dtype=np.float32)[positions])
+            elif documents is not None:
+                self._write_vectors(rows, self._embed([documents[i] for i in positions]))
+            for row, i in zip(rows, positions):
+                if documents is not None:
+                    self.db.execute("UPDATE rows SET document = ? WHERE idx = ?", (documents[i], int(row)))
+                if metadatas is not None:
+                    self.db.execute("UPDATE rows SET metadata = ? WHERE idx = ?", (json.dumps(metadatas[i]), int(row)))
+            self._flush()
+
+    def upsert(self, ids: List[str], documents: Optional[List[str]] = None, metadatas: Optional[List[Dict]] = None, embeddings=None):
+        with self._locked(exclusive=True):
+            existing = self._existing(ids)
+            self.update(ids, documents, metadatas, embeddings)
+            new = [i for i, doc_id in enumerate(ids) if doc_id not in existing]
+            if new:
+                self.add(
+                    [ids[i] for i in new],
+                    [documents[i] for i in new] if documents is not None else None,
+                    [metadatas[i] for i in new] if metadatas is not None else None,
+                    np.asarray(embeddings)[new] if embeddings is not None else None,
+                )
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None):
+        """Remove rows. Their vector slots are tombstoned and reclaimed by compact()."""
+        with self._locked(exclusive=True):
+            if ids is None and where is None:
+                return
+            found = self.get(ids=ids, where=where, include=[])
+            existing = self._existing(found["ids"])
+            if not existing:
+                return
+            self._open_arrays()
+            rows = np.array(sorted(existing.values()))
+            self._lists[rows] = DELETED
+            for start in range(0, len(found["ids"]), 500):
+                part = found["ids"][start:start + 500]
+                self.db.execute(f"DELETE FROM rows WHERE id IN ({','.join('?' * len(part))})", part)
+            self._count -= len(rows)
+            self._ivf = None
+            self._flush()
+            if self._next - self._count > max(self._count, MIN_CAPACITY):
+                self.compact()
+
+    def compact(self):
+        """Move live rows down over deleted slots so row numbers are contiguous again."""
+        with self._locked(exclusive=True):
+            self._open_arrays()
+            live = [row[0] for row in self.db.execute("SELECT idx FROM rows ORDER BY idx")]
+            # Rows only ever move to a lower index, so renumbering in ascending order never collides
+            for new_idx, old_idx in enumerate(live):
+                if new_idx != old_idx:
+                    self._vectors[new_idx] = self._vectors[old_idx]
+                    self._scales[new_idx] = self._scales[old_idx]
+                    self._lists[new_idx] = self._lists[old_idx]
+                    self.db.execute("UPDATE rows SET idx = ? WHERE idx = ?", (new_idx, old_idx))
+            if self._lists is not None:
+                self._lists[len(live):self._next] = UNASSIGNED
+            self._next = len(live)
+            self._ivf = None
+            self._flush()
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None, limit: Optional[int] = None, offset: Optional[int] = None, include: Optional[List[str]] = None):
+        include = include or ["documents", "metadatas"]
+        with self._locked():
+            if ids is not None:
+                rows = []
+                for start in range(0, len(ids), 500):
+                    part = ids[start:start + 500]
+                    placeholders = ",".join("?" * len(part))
+                    rows.extend(self.db.execute(f"SELECT idx, id, document, metadata FROM rows WHERE id IN ({placeholders}) ORDER BY idx", part).fetchall())
+            else:
+                rows = self.db.execute(
+                    "SELECT idx, id, document, metadata FROM rows ORDER BY idx LIMIT ? OFFSET ?",
+                    (limit if limit is not None else -1, offset or 0),
+                ).fetchall()
+            metadatas = [json.loads(row[3]) for row in rows]
+            if where:
+                keep = [i for i, meta in enumerate(metadatas) if all(meta.get(k) == v for k, v in where.items())]
+                rows = [rows[i] for i in keep]
+                metadatas = [metadatas[i] for i in keep]
+            result = {"ids": [row[1] for row in rows]}
+            result["documents"] = [row[2] for row in rows] if "documents" in include else None
+            result["metadatas"] = metadatas if "metadatas" in include else None
+            if "embeddings" in include:
+                self._open_arrays()
+                result["embeddings"] = self._dequantize(np.array([row[0] for row in rows], dtype=np.int64)) if rows else []
+            return result
+
+    def build_index(self, nlist: Optional[int] = None, iterations: int = 10, sample_size: int = 50000):
+        """Train IVF centroids with spherical k-means and assign every row to its nearest list."""
+        with self._locked(exclusive=True):
+            self._open_arrays()
+            if self._count == 0:
+                return
+            live = np.nonzero(np.asarray(self._lists[:self._next]) != DELETED)[0]
+            n = len(live)
+            nlist = nlist or int(min(4096, max(16, np.sqrt(n))))
+            rng = np.random.default_rng(0)
+            sample_rows = np.sort(rng.choice(live, size=min(n, sample_size), replace=False))
+            sample = _normalize(self._dequantize(sample_rows))
+            nlist = min(nlist, len(sample))
+            centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+            for _ in range(iterations):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                for c in range(nlist):
+                    members = sample[labels == c]
+                    if len(members):
+                        centroids[c] = members.mean(axis=0)
+                centroids = _normalize(centroids)
+            self._centroids = centroids.astype(np.float32)
+            np.save(self._file("centroids.npy"), self._centroids)
+            for start in range(0, n, SCORE_BLOCK_ROWS):
+                rows = live[start:start + SCORE_BLOCK_ROWS]
+                self._lists[rows] = self._assign(self._dequantize(rows))
+            self.trained_on = n
+            self._set_info("trained_on", n)
+            self._ivf = None
+            self._flush()
+
+    def _inverted_lists(self):
+        if self._ivf is None:
+            # Deleted and unassigned rows sort before list 0, so no list boundary includes them
+            lists = np.asarray(self._lists[:self._next])
+            order = np.argsort(lists, kind="stable")
+            bounds = np.searchsorted(lists[order], np.arange(len(self._centroids) + 1))
+            self._ivf = (order, bounds)
+        return self._ivf
+
+    def _candidates(self, query: np.ndarray, nprobe: int) -> Optional[np.ndarray]:
+        if self._centroids is None:
+            return None
+        order, bounds = self._inverted_lists()
+        probe = np.argsort(-(self._centroids @ query))[:nprobe]
+        parts = [order[bounds[c]:bounds[c + 1]] for c in probe]
+        # Rows added after training but before assignment are always scanned
+        unassigned = np.nonzero(np.asarray(self._lists[:self._next]) == UNASSIGNED)[0]
+        return np.sort(np.concatenate(parts + [unassigned]))
+
+    def _score(self, rows: Optional[np.ndarray], query: np.ndarray):
+        if rows is None:
+            scores = np.empty(self._next, dtype=np.float32)
+            for start in range(0, self._next, SCORE_BLOCK_ROWS):
+                end = min(start + SCORE_BLOCK_ROWS, self._next)
+                block = np.asarray(self._vectors[start:end], dtype=np.float32)
+                scores[start:end] = (block @ query) * self._scales[start:end]
+            scores[np.asarray(self._lists[:self._next]) == DELETED] = -np.inf
+            return np.arange(self._next), scores
+        block = np.asarray(self._vectors[rows], dtype=np.float32)
+        return rows, (block @ query) * self._scales[rows]
+
+    def query(self, query_embeddings=None, query_texts: Optional[List[str]] = None, n_results: int = 10, nprobe: Optional[int] = None, **_):
+        if query_embeddings is None:
+            query_embeddings = self._embed(query_texts)
+        queries = _normalize(np.asarray(query_embeddings, dtype=np.float32))
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        with self._locked():
+            self._open_arrays()
+            if self._count == 0:
+                for key in result:
+                    result[key] = [[] for _ in queries]
+                return result
+            nprobe = nprobe or (max(4, len(self._centroids) // 16) if self._centroids is not None else 0)
+            for query in queries:
+                rows, scores = self._score(self._candidates(query, nprobe), query)
+                k = min(n_results, len(scores), self._count)
+                top = np.argpartition(-scores, k - 1)[:k] if k else np.array([], dtype=np.int64)
+                top = top[np.argsort(-scores[top])]
+                hit_rows = [int(r) for r in rows[top]]
+                fetched = {}
+                if hit_rows:
+                    placeholders = ",".join("?" * len(hit_rows))
+                    for idx, doc_id, document, metadata in self.db.execute(
+                        f"SELECT idx, id, document, metadata FROM rows WHERE idx IN ({placeholders})", hit_rows
+                    ):
+                        fetched[idx] = (doc_id, document, json.loads(metadata))
+                result["ids"].append([fetched[r][0] for r in hit_rows])
+                result["documents"].append([fetched[r][1] for r in hit_rows])
+                result["metadatas"].append([fetched[r][2] for r in hit_rows])
+                # Cosine distance, so lower is closer as with Chroma
+                result["distances"].append([float(1.0 - s) for s in scores[top]])
+        return result
+
+    def close(self):
+        with self.lock:
+            self._vectors = self._scales = self._lists = None
+            self.db.close()
+            self._lock_file.close()
+
+class MmapVectorClient:
+    """Drop-in for chromadb.PersistentClient backed by MmapCollection directories."""
+
+    def __init__(self, path: str, dtype: str = "int8"):
+        if dtype not in ("int8", "float16"):
+            raise ValueError(f"Unsupported vector dtype: {dtype}")
+        self.path = path
+        self.dtype = dtype
+        self.lock = threading.Lock()
+        self.collections: Dict[str, MmapCollection] = {}
+        os.makedirs(path, exist_ok=True)
+
+    def _collection_path(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def get_or_create_collection(self, name: str, embedding_function=None) -> MmapCollection:
+        with self.lock:
+            collection = self.collections.get(name)
+            if collection is None:
+                collection = MmapCollection(self._collection_path(name), name, embedding_function, self.dtype)
+                self.collections[name] = collection
+            elif embedding_function is not None:
+                collection.embedding_function = embedding_function
+            return collection
+
+    def get_collection(self, name: str, embedding_function=None) -> MmapCollection:
+        with self.lock:
+            if not os.path.isdir(self._collection_path(name)):
+                # Another process may have deleted it since we opened it
+                stale = self.collections.pop(name, None)
+                if stale is not None:
+                    stale.close()
+                raise ValueError(f"Collection {name} does not exist")
+        return self.get_or_create_collection(name, embedding_function)
+
+    def list_collections(self) -> List[str]:
+        return sorted(entry.name for entry in os.scandir(self.path) if entry.is_dir())
+
+    def delete_collection(self, name: str):
+        with self.lock:
+            collection = self.collections.pop(name, None)
+            if collection is not None:
+                collection.close()
+            shutil.rmtree(self._collection_path(name), ignore_errors=True)
+
+def export_chroma(chroma_path: str, out_path: str, dtype: str = "int8", batch_size: int = 1000):
+    """Copy every collection of a Chroma database, with its stored embeddings, into an mmap store."""
+    import chromadb
+    source = chromadb.PersistentClient(path=chroma_path)
+    target = MmapVectorClient(out_path, dtype=dtype)
+    for entry in source.list_collections():
+        # Chroma >= 0.6 returns names, older versions return Collection objects
+        name = entry if isinstance(entry, str) else entry.name
+        collection = source.get_collection(name=name)
+        destination = target.get_or_create_collection(name)
+        offset = 0
+        while True:
+            batch = collection.get(limit=batch_size, offset=offset, include=["documents", "metadatas", "embeddings"])
+            if not batch['ids']:
+                break
+            destination.add(ids=batch['ids'], documents=batch['documents'], metadatas=batch['metadatas'], embeddings=batch['embeddings'])
+            offset += len(batch['ids'])
+        if destination.count() >= IVF_TRAIN_THRESHOLD:
+            destination.build_index()
+        print(f"Exported {name}: {destination.count()} vectors")
+    registry = os.path.join(chroma_path, "partitions.json")
+    if os.path.exists(registry):
+        shutil.copy(registry, os.path.join(out_path, "partitions.json"))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a chroma_db directory into a memory-mapped vector store")
+    parser.add_argument("chroma_path")
+    parser.add_argument("out_path")
+    parser.add_argument("--dtype", choices=["int8", "float16"], default="int8")
+    args = parser.parse_args()
+    export_chroma(args.chroma_path, args.out_path, dtype=args.dtype)
@@ -0,0 +1,90 @@
+import importlib.util
+import os
+import sys
+import types
+import pytest
+
+# Tests import modules as app.<name>, the same way uvicorn loads app.main
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_stubbed = set()
+
+def _stub(name: str, **attrs):
+    # Only stand in for heavy optional dependencies that aren't installed here
+    top = name.split(".")[0]
+    if top not in _stubbed and importlib.util.find_spec(top) is not None:
+        return
+    _stubbed.add(top)
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    parent, _, child = name.rpartition(".")
+    if parent:
+        setattr(sys.modules[parent], child, module)
+
+class _Anything:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def __getattr__(self, name):
+        return self
+
+_stub("chromadb", PersistentClient=_Anything, HttpClient=_Anything)
+_stub("chromadb.utils")
+_stub("chromadb.utils.embedding_functions", SentenceTransformerEmbeddingFunction=_Anything)
+_stub("sentence_transformers", SentenceTransformer=_Anything)
+_stub("pypdf", PdfReader=_Anything)
+_stub("docx", Document=_Anything)
+_stub("pandas")
+_stub("PIL", Image=_Anything())
+_stub("pytesseract")
+_stub("markdown")
+_stub("openai", OpenAI=_Anything)
+
+class _Server:
+    def __init__(self, name):
+        self.name = name
+
+    def list_tools(self):
+        return lambda handler: handler
+
+    call_tool = list_tools
+
+_stub("mcp")
+_stub("mcp.server", Server=_Server)
+_stub("mcp.server.models", InitializationOptions=_Anything)
+_stub("mcp.types", Tool=types.SimpleNamespace, TextContent=types.SimpleNamespace, ImageContent=types.SimpleNamespace,
+      EmbeddedResource=types.SimpleNamespace)
+_stub("requests")
+_stub("dotenv", load_dotenv=lambda *args, **kwargs: None)
+
+if importlib.util.find_spec("prometheus_client") is None:
+    from contextlib import contextmanager
+
+    metrics = types.ModuleType("app.metrics")
+    for metric in ("STAGE_LATENCY", "LLM_LATENCY", "PROVIDER_ERRORS", "PROVIDER_FALLBACKS", "INDEX_QUEUE_DEPTH",
+                   "INDEX_FILES_PER_SECOND", "INDEXED_FILES", "DEDUPLICATED_FILES", "DEDUPLICATED_CHUNKS",
+                   "PARSE_FAILURES", "SCHEDULER_QUEUE_DEPTH", "SCHEDULER_WAIT", "SCHEDULER_REJECTIONS"):
+        setattr(metrics, metric, _Anything())
+
+    @contextmanager
+    def timed(stage):
+        yield
+
+    @contextmanager
+    def timed_llm_call(provider, model):
+        yield
+
+    metrics.timed = timed
+    metrics.timed_llm_call = timed_llm_call
+    metrics.record_provider_error = metrics.record_fallback = metrics.record_parse_failure = lambda *args: None
+    sys.modules["app.metrics"] = metrics
+
+@pytest.fixture(autouse=True)
+def _isolated_state(tmp_path, monkeypatch):
+    # Never touch the real ~/.litelabs state database
+    monkeypatch.delenv("STATE_DB", raising=False)
+    monkeypatch.setenv("LITELABS_DATA_DIR", str(tmp_path / "state"))
@@ -0,0 +1,57 @@
+import pytest
+from app.chat_engine import ChatEngine
+from app.llm_scheduler import ProviderBusy
+
+@pytest.fixture
+def engine(monkeypatch):
+    for key in ("MODE", "OPENAI_API_KEY", "OPENROUTER_API_KEY", "GEMINI_API_KEY", "GROQ_API_KEY", "ZOHO_REFRESH_TOKEN"):
+        monkeypatch.delenv(key, raising=False)
+    return ChatEngine()
+
+def test_request_settings_switch_mode_even_without_key(engine):
+    engine.apply_settings({"mode": "GROQ", "groq_key": None})
+    assert engine.mode == "GROQ"
+
+def test_synced_settings_keep_mode_without_key(engine):
+    engine.apply_settings({"mode": "GROQ", "groq_model": "llama-3.1-8b-instant"}, synced=True)
+    assert engine.mode == "LOCAL"
+    assert engine.groq_model == "llama-3.1-8b-instant"
+
+def test_synced_settings_switch_mode_with_shared_key(engine):
+    engine.apply_settings({"mode": "GROQ", "groq_key": "gsk-secret"}, synced=True)
+    assert (engine.mode, engine.groq_api_key) == ("GROQ", "gsk-secret")
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = ""
+
+    def json(self):
+        return {"choices": [{"message": {"content": "answer"}}]}
+
+def _openrouter(engine, monkeypatch, responses):
+    calls = []
+
+    def post(url, headers, json, timeout=None):
+        calls.append(json["model"])
+        return responses.pop(0)
+
+    monkeypatch.setattr("app.chat_engine.requests.post", post, raising=False)
+    engine.apply_settings({"mode": "OPENROUTER", "openrouter_key": "sk-or", "openrouter_model": "google/gemini-2.0-flash-exp:free"})
+    return calls
+
+def test_openrouter_fallbacks_stop_once_the_provider_is_blocked(engine, monkeypatch):
+    calls = _openrouter(engine, monkeypatch, [FakeResponse(429, {"Retry-After": "30"})])
+    with pytest.raises(ProviderBusy) as error:
+        engine._generate_response("question", "context")
+    assert len(calls) == 1
+    assert error.value.retry_after == pytest.approx(30, abs=1)
+
+def test_openrouter_fallbacks_are_charged_to_the_limiter(engine, monkeypatch):
+    calls = _openrouter(engine, monkeypatch, [FakeResponse(404), FakeResponse(503), FakeResponse(200)])
+    limiter = engine.scheduler.limiter("openrouter")
+    before = limiter.requests.tokens
+    assert engine._generate_response("question", "context") == "answer"
+    assert len(calls) == 3
+    assert before - limiter.requests.tokens == pytest.approx(2, abs=0.1)
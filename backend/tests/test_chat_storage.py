@@ -0,0 +1,36 @@
+import json
+import multiprocessing
+from app.chat_storage import ChatStorage, LEGACY_STORAGE_FILE
+
+def _legacy_file(tmp_path):
+    session = {
+        "id": "s1", "name": "Old chat", "directory_path": "/docs", "created_at": "2024-01-01T00:00:00",
+        "messages": [{"role": "user", "content": "hi", "sources": [], "timestamp": "2024-01-01T00:00:01"}],
+    }
+    (tmp_path / LEGACY_STORAGE_FILE).write_text(json.dumps({"sessions": {"s1": session}}))
+
+def test_json_sessions_are_imported_once(tmp_path):
+    _legacy_file(tmp_path)
+    storage = ChatStorage(str(tmp_path))
+    assert storage.get_session("s1")["messages"][0]["content"] == "hi"
+    assert not (tmp_path / LEGACY_STORAGE_FILE).exists()
+    assert (tmp_path / (LEGACY_STORAGE_FILE + ".migrated")).exists()
+
+    # A restored copy of the old file is not imported a second time
+    _legacy_file(tmp_path)
+    assert len(ChatStorage(str(tmp_path)).get_session("s1")["messages"]) == 1
+
+def test_workers_starting_together_import_once(tmp_path):
+    _legacy_file(tmp_path)
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=ChatStorage, args=(str(tmp_path),)) for _ in range(4)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+    assert [process.exitcode for process in workers] == [0, 0, 0, 0]
+    assert len(ChatStorage(str(tmp_path)).get_session("s1")["messages"]) == 1
+
+def test_state_db_defaults_outside_the_source_tree(tmp_path):
+    storage = ChatStorage(legacy_path=str(tmp_path))
+    assert storage.db_path == str(tmp_path / "state" / "state.db")
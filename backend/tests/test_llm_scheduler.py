@@ -0,0 +1,170 @@
+import asyncio
+import time
+import pytest
+from app.llm_scheduler import BATCH, INTERACTIVE, LLMScheduler, ProviderBusy, TokenBucket, estimate_tokens, parse_reset
+
+@pytest.fixture(autouse=True)
+def _no_limit_overrides(monkeypatch):
+    for provider in ("GROQ", "OPENROUTER", "OPENAI", "TEST"):
+        monkeypatch.delenv(f"{provider}_RPM", raising=False)
+        monkeypatch.delenv(f"{provider}_TPM", raising=False)
+
+def test_parse_reset_formats():
+    assert parse_reset("7.66s") == pytest.approx(7.66)
+    assert parse_reset("2m59.56s") == pytest.approx(179.56)
+    assert parse_reset("120ms") == pytest.approx(0.12)
+    assert parse_reset("1h") == 3600
+    assert parse_reset(str((time.time() + 30) * 1000)) == pytest.approx(30, abs=1)
+    assert parse_reset(None) is None
+
+def test_token_bucket_refills_up_to_capacity():
+    bucket = TokenBucket(capacity=10, per_minute=60)
+    bucket.tokens = 0
+    bucket.refill(bucket.updated + 3)
+    assert bucket.tokens == pytest.approx(3)
+    assert bucket.wait_time(5) == pytest.approx(2)
+    bucket.refill(bucket.updated + 100)
+    assert bucket.tokens == 10
+    # Oversized requests only wait for a full bucket
+    assert bucket.wait_time(50) == 0
+
+def test_env_overrides_default_limits(monkeypatch):
+    monkeypatch.setenv("GROQ_RPM", "5")
+    limiter = LLMScheduler().limiter("groq")
+    assert limiter.requests.capacity == 5
+    assert limiter.tokens.capacity == 6000
+
+def test_priority_order_and_fifo_within_priority(monkeypatch):
+    monkeypatch.setenv("TEST_RPM", "600")
+    scheduler = LLMScheduler()
+    order = []
+
+    async def call(name, priority):
+        async with scheduler.slot("test", cost=1, priority=priority, timeout=5):
+            order.append(name)
+
+    async def main():
+        limiter = scheduler.limiter("test")
+        limiter.requests.tokens = 0
+        limiter.requests.updated = time.monotonic()
+        await asyncio.gather(call("batch1", BATCH), call("batch2", BATCH), call("query1", INTERACTIVE), call("query2", INTERACTIVE))
+
+    asyncio.run(main())
+    assert order == ["query1", "query2", "batch1", "batch2"]
+
+def test_fails_fast_when_the_wait_exceeds_the_deadline():
+    scheduler = LLMScheduler()
+
+    async def main():
+        scheduler.limiter("groq").requests.tokens = 0
+        async with scheduler.slot("groq", cost=1, timeout=0.5):
+            pass
+
+    with pytest.raises(ProviderBusy) as error:
+        asyncio.run(main())
+    assert error.value.retry_after > 0.5
+
+def test_groq_request_headers_are_daily():
+    scheduler = LLMScheduler()
+    scheduler.observe("groq", 200, {
+        "x-ratelimit-limit-requests": "14400",
+        "x-ratelimit-remaining-requests": "14370",
+        "x-ratelimit-reset-requests": "2m59.56s",
+        "x-ratelimit-limit-tokens": "12000",
+        "x-ratelimit-remaining-tokens": "11000",
+        "x-ratelimit-reset-tokens": "5s",
+    })
+    limiter = scheduler.limiter("groq")
+    assert limiter.requests.capacity == 30
+    assert limiter.requests.rate == pytest.approx(0.5)
+    assert limiter.tokens.capacity == 12000
+    assert limiter.tokens.rate == pytest.approx(200)
+    assert limiter.tokens.tokens <= 11000
+    assert limiter.blocked_until == 0
+
+def test_exhausted_daily_quota_blocks_until_reset():
+    scheduler = LLMScheduler()
+    scheduler.observe("groq", 200, {"x-ratelimit-limit-requests": "14400", "x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "1h"})
+    assert scheduler.limiter("groq").blocked_until - time.monotonic() == pytest.approx(3600, abs=5)
+
+def test_request_headers_never_raise_capacity_above_rpm():
+    scheduler = LLMScheduler()
+    scheduler.observe("openrouter", 200, {"X-RateLimit-Limit": "200", "X-RateLimit-Remaining": "199"})
+    limiter = scheduler.limiter("openrouter")
+    assert limiter.requests.capacity == 20
+    scheduler.observe("openrouter", 200, {"X-RateLimit-Limit": "10", "X-RateLimit-Remaining": "3"})
+    assert limiter.requests.capacity == 10
+    assert limiter.requests.rate == pytest.approx(10 / 60)
+    assert limiter.requests.tokens <= 3
+
+def test_429_blocks_for_retry_after():
+    scheduler = LLMScheduler()
+    scheduler.observe("openai", 429, {"retry-after": "12"})
+    assert scheduler.limiter("openai").blocked_until - time.monotonic() == pytest.approx(12, abs=1)
+    scheduler.observe(None, 429, {})
+
+def test_estimate_tokens():
+    assert estimate_tokens("x" * 400, completion_tokens=100) == 200
+
+def test_cancelled_waiters_do_not_spend_budget(monkeypatch):
+    monkeypatch.setenv("TEST_RPM", "60")
+    scheduler = LLMScheduler()
+
+    async def call():
+        async with scheduler.slot("test", cost=2000, priority=BATCH, timeout=60):
+            pass
+
+    async def main():
+        limiter = scheduler.limiter("test")
+        limiter.requests.tokens = 0
+        limiter.requests.updated = time.monotonic()
+        tasks = [asyncio.ensure_future(call()) for _ in range(3)]
+        await asyncio.sleep(0.1)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.sleep(1.5)
+        assert not limiter.queue
+        limiter.wait_time(0, time.monotonic())
+        return limiter.requests.tokens
+
+    # Nothing was granted to the cancelled waiters, so the bucket refilled undisturbed
+    assert asyncio.run(main()) == pytest.approx(1.6, abs=0.2)
+
+def test_slot_granted_to_a_cancelled_waiter_is_given_back(monkeypatch):
+    monkeypatch.setenv("TEST_RPM", "60")
+    scheduler = LLMScheduler()
+
+    async def call():
+        # No deadline, so the waiter awaits the slot future directly
+        async with scheduler.slot("test", cost=2000):
+            pass
+
+    async def main():
+        limiter = scheduler.limiter("test")
+        limiter.requests.tokens = 0
+        limiter.requests.updated = time.monotonic()
+        task = asyncio.ensure_future(call())
+        await asyncio.sleep(0)
+        tokens_before = limiter.tokens.tokens
+        # Grant the slot, then cancel before the waiter gets to run
+        limiter.requests.tokens = 1
+        scheduler._dispatch(limiter)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert task.cancelled()
+        return limiter.requests.tokens, tokens_before - limiter.tokens.tokens
+
+    requests_left, tokens_spent = asyncio.run(main())
+    assert requests_left == pytest.approx(1, abs=0.05)
+    assert tokens_spent == pytest.approx(0, abs=5)
+
+def test_try_acquire_charges_only_when_a_call_can_go(monkeypatch):
+    monkeypatch.setenv("TEST_RPM", "60")
+    scheduler = LLMScheduler()
+    limiter = scheduler.limiter("test")
+    assert scheduler.try_acquire("test", 100) == 0
+    assert limiter.requests.tokens == pytest.approx(59, abs=0.1)
+    scheduler.observe("test", 429, {"retry-after": "7"})
+    assert scheduler.try_acquire("test", 100) == pytest.approx(7, abs=0.5)
+    assert limiter.requests.tokens == pytest.approx(59, abs=0.2)
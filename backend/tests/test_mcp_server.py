@@ -0,0 +1,45 @@
+import asyncio
+import importlib
+import pytest
+
+@pytest.fixture
+def mcp_server(tmp_path, monkeypatch):
+    monkeypatch.setenv("VECTOR_STORE", "mmap")
+    monkeypatch.setenv("VECTOR_DB_PATH", str(tmp_path / "vector_db"))
+    module = importlib.import_module("app.mcp_server")
+    monkeypatch.setattr(module, "MAX_READ_CHARS", 50)
+    monkeypatch.setattr(module, "MAX_READ_LINES", 3)
+    return module
+
+def _read(module, **arguments):
+    return asyncio.run(module.handle_call_tool("read_document", arguments))[0].text
+
+@pytest.fixture
+def text_file(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("short\n" + "x" * 120 + "\nlast\n", encoding="utf-8")
+    return str(path)
+
+def test_limit_and_offset_are_validated(mcp_server, text_file):
+    assert "limit must be at least 1" in _read(mcp_server, path=text_file, limit=-5)
+    assert "limit must be at least 1" in _read(mcp_server, path=text_file, limit=0)
+    assert "offset must be 0 or more" in _read(mcp_server, path=text_file, offset=-5, unit="bytes")
+
+def test_limit_is_capped(mcp_server, text_file):
+    text = _read(mcp_server, path=text_file, limit=10 ** 9)
+    assert text.startswith("short\n" + "x" * 44 + "\n\n[Truncated.")
+    assert "offset=50" in text
+
+def test_reading_past_the_end(mcp_server, text_file):
+    for unit in ("chars", "lines", "bytes"):
+        assert _read(mcp_server, path=text_file, offset=10 ** 6, unit=unit).startswith("[End of document")
+
+def test_overlong_line_points_to_chars(mcp_server, text_file):
+    text = _read(mcp_server, path=text_file, unit="lines")
+    # Whole lines are kept while they fit
+    assert text.startswith("short\n\n\n[Truncated.") and "offset=1 " in text
+    text = _read(mcp_server, path=text_file, offset=1, unit="lines")
+    assert text.startswith("x" * 50 + "\n\n[Truncated. Line 1 is longer than 50 chars")
+    assert 'unit="chars" and offset=56' in text
+    assert _read(mcp_server, path=text_file, offset=56).startswith("x" * 50 + "\n\n[Truncated.")
+    assert _read(mcp_server, path=text_file, offset=106) == "x" * 20 + "\nlast\n"
@@ -0,0 +1,61 @@
+import pytest
+from app.parsers import DocumentParser
+
+TEXT = "".join(f"line {i} é\n" for i in range(10))
+
+@pytest.fixture
+def text_file(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text(TEXT, encoding="utf-8")
+    return str(path)
+
+def _read_all(path, unit, limit):
+    parts, offset = [], 0
+    while offset is not None:
+        content, offset = DocumentParser.read_range(path, offset=offset, limit=limit, unit=unit)
+        parts.append(content)
+    return parts
+
+@pytest.mark.parametrize("limit", [1, 7, 25, len(TEXT), len(TEXT) + 5])
+def test_chars_continuation_reads_everything_once(text_file, limit):
+    parts = _read_all(text_file, "chars", limit)
+    assert "".join(parts) == TEXT
+    assert all(len(part) <= limit for part in parts)
+
+@pytest.mark.parametrize("limit", [1, 3, 10, 11])
+def test_lines_continuation_reads_whole_lines(text_file, limit):
+    parts = _read_all(text_file, "lines", limit)
+    assert "".join(parts) == TEXT
+    assert all(part.endswith("\n") and part.count("\n") <= limit for part in parts)
+
+def test_lines_without_trailing_newline(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("a\nb\nc", encoding="utf-8")
+    assert DocumentParser.read_range(str(path), offset=1, limit=1, unit="lines") == ("b\n", 2)
+    assert DocumentParser.read_range(str(path), offset=2, limit=5, unit="lines") == ("c", None)
+
+@pytest.mark.parametrize("limit", [4, 16, 1000])
+def test_bytes_continuation_covers_the_file(text_file, limit):
+    data = TEXT.encode("utf-8")
+    offset, offsets = 0, []
+    while offset is not None:
+        offsets.append(offset)
+        _, offset = DocumentParser.read_range(text_file, offset=offset, limit=limit, unit="bytes")
+    assert offsets == list(range(0, len(data), limit))
+
+def test_reads_past_the_end_are_empty(text_file):
+    for unit in ("chars", "lines", "bytes"):
+        assert DocumentParser.read_range(text_file, offset=10 ** 6, limit=10, unit=unit) == ("", None)
+
+@pytest.mark.parametrize("unit", ["chars", "lines", "bytes"])
+def test_slice_matches_file_reads(text_file, unit):
+    # Page and row ranges are sliced in memory and must continue the same way as files
+    offset, limit = 3, 4
+    assert DocumentParser._slice(TEXT, offset, limit, unit) == DocumentParser.read_range(text_file, offset=offset, limit=limit, unit=unit)
+    assert DocumentParser._slice(TEXT, 0, None, unit) == (TEXT, None)
+
+def test_line_char_offset(text_file, tmp_path):
+    for line in (0, 1, 5, 10):
+        offset = DocumentParser.line_char_offset(text_file, line)
+        assert offset == len("".join(f"line {i} é\n" for i in range(line)))
+    assert DocumentParser.line_char_offset(text_file, 11) is None
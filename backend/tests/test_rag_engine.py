@@ -0,0 +1,104 @@
+import multiprocessing
+import numpy as np
+from app import rag_engine
+from app.rag_engine import LEGACY_COLLECTION, RAGEngine
+from app.vector_store import MmapVectorClient
+
+def test_converted_legacy_store_starts_with_mmap_backend(tmp_path, monkeypatch):
+    # What `python -m app.vector_store` leaves behind for a pre-partition chroma_db
+    converted = MmapVectorClient(str(tmp_path))
+    legacy = converted.get_or_create_collection(LEGACY_COLLECTION)
+    ids = ["/docs/a/one.txt", "/docs/a/two.txt", "/docs/b/three.txt"]
+    legacy.add(
+        ids=ids,
+        documents=["one", "two", "three"],
+        metadatas=[{"source": i, "directory": i.rsplit("/", 1)[0]} for i in ids],
+        embeddings=np.eye(3, 8, dtype=np.float32),
+    )
+    legacy.close()
+
+    monkeypatch.setenv("VECTOR_STORE", "mmap")
+    engine = RAGEngine(persist_directory=str(tmp_path))
+
+    assert LEGACY_COLLECTION not in engine.client.list_collections()
+    assert sorted(engine.indexed_directories()) == ["/docs/a", "/docs/b"]
+    partition = engine.client.get_collection(engine.registry["/docs/a"])
+    assert sorted(partition.get()["ids"]) == ids[:2]
+
+    # A second start finds nothing left to migrate
+    assert sorted(RAGEngine(persist_directory=str(tmp_path)).indexed_directories()) == ["/docs/a", "/docs/b"]
+
+def _start_engine(path):
+    RAGEngine(persist_directory=path)
+
+def test_workers_starting_together_migrate_once(tmp_path, monkeypatch):
+    converted = MmapVectorClient(str(tmp_path))
+    legacy = converted.get_or_create_collection(LEGACY_COLLECTION)
+    ids = [f"/docs/{d}/{i}.txt" for d in "abc" for i in range(400)]
+    legacy.add(
+        ids=ids,
+        documents=ids,
+        metadatas=[{"source": i, "directory": i.rsplit("/", 1)[0]} for i in ids],
+        embeddings=np.random.default_rng(0).normal(size=(len(ids), 8)),
+    )
+    legacy.close()
+    monkeypatch.setenv("VECTOR_STORE", "mmap")
+
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_start_engine, args=(str(tmp_path),)) for _ in range(3)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+    assert [process.exitcode for process in workers] == [0, 0, 0]
+
+    engine = RAGEngine(persist_directory=str(tmp_path))
+    assert sorted(engine.indexed_directories()) == ["/docs/a", "/docs/b", "/docs/c"]
+    assert sum(partition.count() for partition in engine._partitions()) == len(ids)
+
+class FakeCollection:
+    def __init__(self, name, metadata=None):
+        self.name = name
+        self.metadata = metadata
+
+    def modify(self, metadata=None):
+        self.metadata = metadata
+
+class FakeChromaServer:
+    """The few HttpClient calls the registry makes, shared by every "node" in a test."""
+
+    def __init__(self):
+        self.collections = {}
+
+    def list_collections(self):
+        return list(self.collections)
+
+    def get_collection(self, name, embedding_function=None):
+        if name not in self.collections:
+            raise ValueError(f"Collection {name} does not exist")
+        return self.collections[name]
+
+    def get_or_create_collection(self, name, embedding_function=None, metadata=None):
+        return self.collections.setdefault(name, FakeCollection(name, metadata))
+
+    def delete_collection(self, name):
+        del self.collections[name]
+
+def test_chroma_server_registry_is_shared_between_nodes(tmp_path, monkeypatch):
+    server = FakeChromaServer()
+    monkeypatch.setattr(rag_engine.chromadb, "HttpClient", lambda **kwargs: server, raising=False)
+    monkeypatch.setenv("CHROMA_HOST", "chroma.internal")
+    monkeypatch.delenv("VECTOR_STORE", raising=False)
+    first = RAGEngine(persist_directory=str(tmp_path / "node1"))
+    second = RAGEngine(persist_directory=str(tmp_path / "node2"))
+
+    first._collection_for("/docs/a", create=True)
+    assert not (tmp_path / "node1" / "partitions.json").exists()
+    # A scoped lookup on another node finds the partition without waiting for the periodic refresh
+    assert second._collection_for("/docs/a").name == RAGEngine.partition_name("/docs/a")
+
+    monkeypatch.setattr(rag_engine, "REGISTRY_REFRESH_SECONDS", 0)
+    first.drop_directory("/docs/a")
+    assert second.indexed_directories() == []
+    assert second._partitions() == []
+    assert server.collections == {}
@@ -0,0 +1,29 @@
+import sqlite3
+import time
+from app import report_builder
+from app.report_builder import ReportBuilder
+
+def test_summary_cache_drops_stale_and_excess_rows(tmp_path, monkeypatch):
+    builder = ReportBuilder(chat_engine=None, storage_path=str(tmp_path))
+    builder._store("old", "summary")
+    with sqlite3.connect(builder.db_path) as conn:
+        conn.execute("UPDATE summary_cache SET used_at = ? WHERE key = 'old'", (time.time() - 40 * 86400,))
+    builder._store("fresh", "summary")
+    assert builder._cached("old") is None
+    assert builder._cached("fresh") == "summary"
+
+    monkeypatch.setattr(report_builder, "SUMMARY_CACHE_MAX_ROWS", 2)
+    builder._store("a", "summary")
+    builder._cached("fresh")
+    builder._store("b", "summary")
+    # The least recently used entry goes first
+    assert [builder._cached(key) for key in ("a", "fresh", "b")] == [None, "summary", "summary"]
+
+def test_existing_cache_table_gains_used_at(tmp_path):
+    with sqlite3.connect(tmp_path / "state.db") as conn:
+        conn.execute("CREATE TABLE summary_cache (key TEXT PRIMARY KEY, summary TEXT NOT NULL)")
+        conn.execute("INSERT INTO summary_cache VALUES ('k', 'summary')")
+    builder = ReportBuilder(chat_engine=None, storage_path=str(tmp_path))
+    assert builder._cached("k") == "summary"
+    builder._store("other", "summary")
+    assert builder._cached("k") == "summary"
@@ -0,0 +1,25 @@
+import os
+from app import settings_store
+from app.settings_store import SettingsStore
+
+SETTINGS = {"mode": "GROQ", "groq_key": "gsk-secret", "openai_key": None, "groq_model": "llama-3.3-70b-versatile"}
+
+def test_api_keys_are_not_stored_when_disabled(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings_store, "PERSIST_API_KEYS", False)
+    saving, other = SettingsStore(str(tmp_path)), SettingsStore(str(tmp_path))
+    saving.save(SETTINGS)
+    assert "gsk-secret" not in (tmp_path / "state.db").read_bytes().decode("latin-1")
+    assert other.poll() == {"mode": "GROQ", "groq_model": "llama-3.3-70b-versatile"}
+    # The saving worker applied the settings itself, so it has nothing new to poll
+    assert saving.poll() is None
+    assert other.poll() is None
+
+def test_api_keys_are_shared_in_a_private_database(tmp_path):
+    SettingsStore(str(tmp_path)).save(SETTINGS)
+    assert SettingsStore(str(tmp_path)).poll() == SETTINGS
+    assert os.stat(tmp_path / "state.db").st_mode & 0o777 == 0o600
+
+def test_existing_database_is_made_private(tmp_path):
+    (tmp_path / "state.db").touch(mode=0o644)
+    SettingsStore(str(tmp_path))
+    assert os.stat(tmp_path / "state.db").st_mode & 0o777 == 0o600
@@ -0,0 +1,140 @@
+import multiprocessing
+import numpy as np
+import pytest
+from app import vector_store
+from app.vector_store import MmapCollection, MmapVectorClient
+
+def _vectors(n, dim=32, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+
+def _add(collection, vectors, start=0):
+    ids = [f"doc{i}" for i in range(start, start + len(vectors))]
+    collection.add(ids=ids, documents=[f"text {i}" for i in range(start, start + len(vectors))],
+                   metadatas=[{"n": i} for i in range(start, start + len(vectors))], embeddings=vectors)
+    return ids
+
+@pytest.mark.parametrize("dtype,tolerance", [("int8", 0.02), ("float16", 0.001)])
+def test_quantization_round_trip(tmp_path, dtype, tolerance):
+    collection = MmapCollection(str(tmp_path), "c", dtype=dtype)
+    vectors = _vectors(50)
+    _add(collection, vectors)
+    stored = collection.get(include=["embeddings"])["embeddings"]
+    expected = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    assert np.abs(stored - expected).max() < tolerance
+
+def test_query_finds_nearest_and_survives_reopen(tmp_path):
+    vectors = _vectors(200)
+    collection = MmapCollection(str(tmp_path), "c")
+    _add(collection, vectors)
+    result = collection.query(query_embeddings=vectors[[7, 42]], n_results=3)
+    assert [ids[0] for ids in result["ids"]] == ["doc7", "doc42"]
+    assert result["metadatas"][0][0] == {"n": 7}
+    assert result["distances"][0][0] < 0.01
+    collection.close()
+
+    reopened = MmapCollection(str(tmp_path), "c")
+    assert reopened.count() == 200
+    assert reopened.query(query_embeddings=vectors[:1], n_results=1)["ids"] == [["doc0"]]
+
+def test_add_existing_id_is_noop(tmp_path):
+    collection = MmapCollection(str(tmp_path), "c")
+    vectors = _vectors(5)
+    _add(collection, vectors)
+    _add(collection, _vectors(5, seed=1))
+    assert collection.count() == 5
+    assert collection.query(query_embeddings=vectors[:1], n_results=1)["ids"] == [["doc0"]]
+
+def test_ivf_search_matches_brute_force(tmp_path):
+    # Clustered data, so probing a few lists finds the true neighbours
+    rng = np.random.default_rng(1)
+    centers = rng.normal(size=(20, 32))
+    vectors = (centers[rng.integers(0, 20, size=2000)] + rng.normal(scale=0.05, size=(2000, 32))).astype(np.float32)
+    collection = MmapCollection(str(tmp_path), "c")
+    _add(collection, vectors)
+    brute = collection.query(query_embeddings=vectors[:10], n_results=1)["ids"]
+    collection.build_index(nlist=16)
+    assert collection._centroids.shape == (16, 32)
+    assert (np.asarray(collection._lists[:2000]) >= 0).all()
+    assert collection.query(query_embeddings=vectors[:10], n_results=1, nprobe=4)["ids"] == brute
+
+def test_rows_added_after_training_are_searchable(tmp_path):
+    collection = MmapCollection(str(tmp_path), "c")
+    _add(collection, _vectors(500))
+    collection.build_index(nlist=8)
+    extra = _vectors(3, seed=5)
+    _add(collection, extra, start=500)
+    assert collection.query(query_embeddings=extra, n_results=1, nprobe=1)["ids"] == [["doc500"], ["doc501"], ["doc502"]]
+
+def test_index_trains_automatically(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_store, "IVF_TRAIN_THRESHOLD", 100)
+    collection = MmapCollection(str(tmp_path), "c")
+    _add(collection, _vectors(150))
+    assert collection._centroids is not None
+    assert collection.trained_on == 150
+
+def test_delete_hides_rows_from_get_and_query(tmp_path):
+    vectors = _vectors(20)
+    collection = MmapCollection(str(tmp_path), "c")
+    _add(collection, vectors)
+    collection.delete(ids=["doc3", "doc4", "missing"])
+    collection.delete(where={"n": 5})
+    assert collection.count() == 17
+    assert collection.get(ids=["doc3", "doc5", "doc6"])["ids"] == ["doc6"]
+    result = collection.query(query_embeddings=vectors[[3]], n_results=20)
+    assert len(result["ids"][0]) == 17
+    assert not {"doc3", "doc4", "doc5"} & set(result["ids"][0])
+
+    # Deleted ids can be added again, and deletes persist across reopen
+    _add(collection, vectors[3:4], start=3)
+    collection.close()
+    reopened = MmapCollection(str(tmp_path), "c")
+    assert reopened.count() == 18
+    assert reopened.query(query_embeddings=vectors[[3]], n_results=1)["ids"] == [["doc3"]]
+
+def test_delete_with_ivf_and_compaction(tmp_path):
+    vectors = _vectors(3000)
+    collection = MmapCollection(str(tmp_path), "c")
+    _add(collection, vectors)
+    collection.build_index(nlist=16)
+    collection.delete(ids=[f"doc{i}" for i in range(2000)])
+    # More than half of the slots were dead, so rows were moved down
+    assert collection._next == 1000
+    assert collection.count() == 1000
+    assert collection.query(query_embeddings=vectors[[2500]], n_results=1, nprobe=16)["ids"] == [["doc2500"]]
+    assert collection.get(ids=["doc2999"], include=["metadatas"])["metadatas"] == [{"n": 2999}]
+
+def test_client_collections(tmp_path):
+    client = MmapVectorClient(str(tmp_path))
+    with pytest.raises(ValueError):
+        client.get_collection("missing")
+    _add(client.get_or_create_collection("a"), _vectors(3))
+    assert client.list_collections() == ["a"]
+    assert client.get_collection("a").count() == 3
+    client.delete_collection("a")
+    assert client.list_collections() == []
+
+def _write_from_worker(path, worker):
+    collection = MmapCollection(path, "c")
+    for batch in range(10):
+        # 10 * 150 rows per worker, so the arrays are grown while the other worker has them mapped
+        start = worker * 10000 + batch * 150
+        _add(collection, _vectors(150, seed=start), start=start)
+    collection.close()
+
+@pytest.mark.skipif(vector_store.fcntl is None, reason="cross-process locking needs fcntl")
+def test_concurrent_workers_share_a_collection(tmp_path):
+    reader = MmapCollection(str(tmp_path), "c")
+    _add(reader, _vectors(1))
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_write_from_worker, args=(str(tmp_path), w)) for w in (1, 2)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+    assert [process.exitcode for process in workers] == [0, 0]
+
+    # The long-lived handle notices the other processes' writes and re-maps the grown arrays
+    assert reader.count() == 3001
+    probe = _vectors(150, seed=20000 + 9 * 150)[:1]
+    assert reader.query(query_embeddings=probe, n_results=1)["ids"] == [["doc21350"]]
+    assert reader.query(query_embeddings=_vectors(1), n_results=1)["ids"] == [["doc0"]]
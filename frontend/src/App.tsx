@@ -439,7 +439,9 @@ function ChatInterface({ activeDirectory, sessionId }: { activeDirectory: string
         sources: resp.data.sources
       }]);
     } catch (err) {
-      setMessages(prev => [...prev, { role: 'assistant', content: 'Intelligence sync failed. Check your local API status.' }]);
+      // Rate limits (429) and provider failures (502) come back with a readable detail
+      const detail = axios.isAxiosError(err) ? err.response?.data?.detail : undefined;
+      setMessages(prev => [...prev, { role: 'assistant', content: detail || 'Intelligence sync failed. Check your local API status.' }]);
     } finally {
       setIsLoading(false);
     }